@@ -14,6 +14,8 @@ from pgr import log
 
 core.RpcHandler.addInterceptr(auth.AuthorizationInterceptor())
 core.RpcHandler.addInterceptr(log.LoggingInterceptor())
+# only registered services can be called
+core.RpcHandler.registerService("pl.simpatico.pgrexample.client.services.ExampleService")
 
 
 # Set GwtRpcHandler as a handler for rpc call
@@ -116,7 +116,6 @@ class AuthorizationInterceptor:
         req = ctx.request
         res = ctx.response
         met = ctx.methodInstance
-        inst = ctx.serviceInstance
 
         ctx.user = None
 
@@ -125,22 +124,22 @@ class AuthorizationInterceptor:
             isTicketFinded, isTicketFine, ticketOwner = self.__getDataFromTicket(
                 ctx.sessionTicket, req, res)
 
-        # check the permission (autorizate)
-        if "__perm__" in inst.__class__.__dict__:
-            if met.__name__ in inst.__perm__:
-                if not isTicketFinded:
-                    raise AuthorizationException("Forbidden method (%s) access without ticket" % met.__name__)
-                if isTicketFinded and not isTicketFine:
-                    raise AuthorizationException("Forbidden method (%s) access with expired ticket" % met.__name__)
-                if ticketOwner == None:
-                    raise AuthorizationException("Forbidden method (%s) access with invalid ticket" % met.__name__)
-
-                havePerm = False
-                if ticketOwner.roles in inst.__perm__[met.__name__]:
-                    havePerm = True
-
-                if not havePerm:
-                    raise AuthorizationException("Forbidden method (%s) access" % met.__name__)
+        # check the permission (autorizate), roles are resolved from __perm__ once per method
+        perm = ctx.requestObject.dispatch.perm
+        if perm != None:
+            if not isTicketFinded:
+                raise AuthorizationException("Forbidden method (%s) access without ticket" % met.__name__)
+            if isTicketFinded and not isTicketFine:
+                raise AuthorizationException("Forbidden method (%s) access with expired ticket" % met.__name__)
+            if ticketOwner == None:
+                raise AuthorizationException("Forbidden method (%s) access with invalid ticket" % met.__name__)
+
+            havePerm = False
+            if ticketOwner.roles in perm:
+                havePerm = True
+
+            if not havePerm:
+                raise AuthorizationException("Forbidden method (%s) access" % met.__name__)
 
 
         if ticketOwner != None:
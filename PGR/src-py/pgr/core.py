@@ -165,8 +165,8 @@ PGR - A Python for Gwt remote procedure call implementation
             });
 
         7. Accessing request processing values.
-           The pgr make accessible to whole rpc processing values by local thread
-           value pgr.core.RpcHandler.ctx. User have access to:
+           The pgr make accessible to whole rpc processing values by context of
+           request pgr.core.RpcHandler.ctx. User have access to:
 
               - request (google.appengine.ext.webapp.Request)
               - requestText (string) - encoded request body
@@ -175,7 +175,9 @@ PGR - A Python for Gwt remote procedure call implementation
               - responseObject - service methor return value
               - responseText (string)
 
-           User can also store custom values on ctx object
+           User can also store custom values on ctx object. Context is bound to request
+           (by contextvars module when available, otherwise to thread) and released after
+           response is written, so its values are not kept until next request.
 
         8. Custom interceptors.
            Pgr allow to add custom interceptors for request processing.
@@ -194,12 +196,168 @@ PGR - A Python for Gwt remote procedure call implementation
            call static method pgr.core.RpcHandler._callInterceptors(name),
            where name parameter is name of other interceptors method.
 
+           Interceptor can be limited to some services or services methods:
+
+            core.RpcHandler.addInterceptr(auth.AuthorizationInterceptor(),
+                ["pkg.AdminService", "pkg.UserService.update"])
+
+           Interceptors limited to services are not called before request decoding.
+
+        9. Compact primitive arrays.
+           By default int, long, float and double arrays are passed to service methods
+           as python lists. Service can receive them as array.array or numpy.ndarray
+           objects, decoded in one step, by set __arrays__ property in service class,
+           __arrays__ is a dict object with method name as key and container as value:
+
+            __arrays__ = {
+                "sumAll" : core.Arrays.ARRAY,
+                "average" : core.Arrays.NUMPY
+            }
+
+        10. Response cache.
+           Responses of read-only service methods can be cached, by set __cache__ property
+           in service class. __cache__ is a dict object with method name as key and tuple of
+           (time to live in seconds, maximal number of cached responses) as value, optionally
+           third element of tuple set to True makes role of authorized user a part of cache key:
+
+            __cache__ = {
+                "sumInts" : (60, 1000),
+                "subArray" : (600, 100, True)
+            }
+
+           Cached response is returned without service method call and response encoding,
+           interceptors are called as usually. Time to live and size must be greater than 0.
+           Requests with cyclic or unhashable parameters values are not cached.
+
+        11. Service instances scope.
+           By default new service instance is created for every request. Service can keep
+           warm state (compiled regexes, connections, lookup tables) by set __scope__ property
+           in service class to one of pgr.core.Scopes values:
+
+               - Scopes.REQUEST - new instance for every request
+               - Scopes.THREAD - one instance per thread
+               - Scopes.SINGLETON - one instance per process
+
+            __scope__ = core.Scopes.SINGLETON
+
+           Instances are created without __init__ call, optional onCreate method of service
+           is called after creation and optional onShutdown method before release. Request
+           instances are released after method call, thread instances when their thread ends,
+           others on pgr.core.RpcHandler.shutdown() or on process exit.
+
+        12. Service methods executors.
+           Service method is called in thread of request by default. CPU heavy methods can
+           be called in pool of processes and blocking methods in bounded pool of threads,
+           by set __executor__ property in service class. __executor__ is a dict object with
+           method name as key and one of pgr.core.Executors values as value:
+
+            __executor__ = {
+                "render" : core.Executors.PROCESS,
+                "fetch" : core.Executors.THREAD
+            }
+
+           Sizes of pools are set by Executors.PROCESS_POOL_SIZE and Executors.THREAD_POOL_SIZE.
+           Pools are started by pgr.core.RpcHandler.warmUp (see warm-up), process pool is not
+           started on first call, because forking of process serving requests in threads
+           can deadlock its child, so services with process executor must be warmed up.
+           In process pool the method is called on instance created in worker process, parameters
+           and return value are pickled and pgr.core.RpcHandler.ctx is not available.
+
+        13. Allowed packages.
+           Service interface name is send by client, so by default only registered services
+           (see warm-up) and types from pgr.sig.__signatures__ can be loaded on request. Set list
+           of packages with other services and VOs to allow them too:
+
+            core.RpcHandler.ALLOWED_PACKAGES = ["pkg.services", "pkg.vo"]
+
+           Set None to allow import of any module on request (not recommended). Names which
+           can't be imported are remembered, so they are not imported again on every request.
+
+        14. Warm-up.
+           Services and VOs modules are imported on first request which use them. To move
+           this cost before first request, register services and call warm-up on start:
+
+            core.RpcHandler.registerService("pkg.services.TestService")
+            core.RpcHandler.warmUp()
+
+           Warm-up imports all types from pgr.sig.__signatures__ and registered services,
+           validates __serialization__ properties, prepares encoding and decoding of all types
+           and sets pgr.core.RpcHandler.ready event. On GAE map pgr.core.RpcWarmUpHandler to
+           /_ah/warmup, it answers 503 until warm-up succeeds. The handler doesn't start
+           executors pools, services with process executor must be warmed up on start.
+
+        15. Statistics.
+           Durations (in milliseconds) of request decode, service method evaluation and
+           response encode, and sizes of request and response are collected per service
+           method in histograms. They are returned by pgr.core.RpcHandler.statistics() or as
+           json by pgr.core.RpcStatsHandler mapped to e.g. /pgr/stats:
+
+            application = webapp.WSGIApplication(
+                [('/services', core.RpcHandler), ('/pgr/stats', core.RpcStatsHandler)],
+                debug=True)
+
+           Every method has count of calls and errors and for every histogram count, mean,
+           max and p50, p90, p99 percentiles (upper bounds of buckets). Collecting is
+           disabled by RpcHandler.STATS = False.
+
+        16. Profiling.
+           Requests can be profiled by cProfile in production. Profiling is enabled by
+           directory for dumps:
+
+            core.RpcHandler.PROFILE_DIR = "/tmp/pgr-profiles"
+            core.RpcHandler.PROFILE_SAMPLE = 0.001
+            core.RpcHandler.PROFILE_THRESHOLD = 0.5
+
+           Part of requests set by PROFILE_SAMPLE is profiled at random (whole request, with
+           decode). When request takes more than PROFILE_THRESHOLD seconds, next call of its
+           method is profiled (evaluate and encode) and dump is kept if it is slow again.
+           Threshold can be set per method by __profile__ property of service class:
+
+            __profile__ = {"search" : 0.2}
+
+           For every profiled request pstats file and text summary with service, method
+           and parameters values are written, named by time, method and process id.
+
+        17. Request limits.
+           Request is checked while it is decoded, so oversized or malformed request is
+           rejected before it is read whole. Limits are set by pgr.core.Limits properties
+           (None disables limit):
+
+            core.Limits.MAX_BODY_SIZE = 1024 * 1024    # bytes of request body
+            core.Limits.MAX_TOKENS = 100000            # tokens in request
+            core.Limits.MAX_STRINGS = 10000            # strings in string table
+            core.Limits.MAX_ARRAY_LENGTH = 100000      # elements of one array
+            core.Limits.MAX_DEPTH = 32                 # nesting of objects and arrays
+
+           pgr.server.RpcApplication refuses bigger body by Content-Length header without
+           reading it.
+
+        18. Batch calls.
+           Several calls can be send in one http request to pgr.core.RpcBatchHandler:
+
+            application = webapp.WSGIApplication(
+                [('/services', core.RpcHandler), ('/services/batch', core.RpcBatchHandler)],
+                debug=True)
+
+           Batch request has one header and one string table shared by all calls:
+           version, flags, string table, number of calls and then every call as in single
+           request (module base url, strong name, service, method, parameters). Responses
+           of calls are joined with new line character, in order of calls. Calls are evaluated
+           in order, or concurrently if RpcBatchHandler.CONCURRENT is True.
+
+           Call which fails in evaluation or names unknown service or method is answered
+           with its own exception response. Error in decoding of parameters values (e.g.
+           malformed or not allowed type) stops reading of following calls, so whole batch
+           is answered with one exception response.
+
 
     - ToDo -
 
         - Exceptions serialization
         - Generator of whole server side stuff
         - Java collections mapping to python list and dict types
+        - Asynchronous (coroutine) service methods and interceptors, needs asyncio which
+          is not available on Python 2 runtime of GAE
 
 """
 
@@ -230,22 +388,75 @@ __err_msg__ = {
     "ser.nf": """The implementation of '%s' service interface have not serialization information, class have to have __serialization__ property whit return type of service methods.""",
     "ser.met.nf": """The implementation of '%s.%s' service method have not information about return type, pleas update __serialization__ property in service class.""",
     "met.nf": """The implementation of '%s' service interface have not implement service method '%s'.""",
+    "par.ne": """The '%s.%s' service method can't be called with %s parameters.""",
+    "scp.ns": """Unsupported scope '%s' of '%s' service, use one of pgr.core.Scopes values.""",
+    "cch.ns": """Invalid cache declaration %r of '%s.%s' service method, use tuple of (time to live > 0, size > 0[, per role]).""",
+    "exe.nst": """Process pool of '%s.%s' service method is not started, register the service and call pgr.core.RpcHandler.warmUp on start.""",
+    "exe.ns": """Unsupported executor '%s' of '%s.%s' service method, use one of pgr.core.Executors values (thread and process executors require multiprocessing module).""",
+    "wrm.err": """Warm-up found %s problems:\n%s""",
+    "cna": """Class '%s' is not allowed, please register its service or add its package to RpcHandler.ALLOWED_PACKAGES.""",
     "cnf": """Can't find or load implementation of class '%s'""",
     "pnf": """Can't find or load package (module) '%s'""",
     "sig.nf": """Can't find signatures dictionary, pleas add pgr.sig module with __signaturs__ property.""",
     "sig.tnf": """Can't find signatures for '%s' type, pleas correct pgr.sig.__signatures__ property.""",
+    "ref.nf": """Invalid back reference '%s' in request, object is not decoded yet.""",
+    "req.lim": """Request exceeds limit %s = %s, see pgr.core.Limits.""",
+    "req.inv": """Invalid token in request, request is malformed (%s).""",
+    "req.eof": """Unexpected end of request, request is incomplete or malformed.""",
+    "np.nf": """The '%s.%s' service method requires numpy arrays, but numpy module can't be imported.""",
+    "ver.ns": """Unsupported version of GWT rpc protocol '%s'.""",
+    "pol.nf": """Can't find or load serialization policy '%s', pleas check RpcHandler.POLICY_DIR property.""",
+    "pol.tnf": """Can't find type '%s' in serialization policy, this application is perhaps out of date.""",
     "sig.ne": """This application is perhaps out of date, the class signature on client and server side not equal for type '%s'."""
 }
 
 
 import sys
+import re
+import os
 import new
+import time
+import atexit
 import threading
+import weakref
+import itertools
 import traceback
 import logging
+import array
+import bisect
+import random
+import cProfile
+import pstats
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+try:
+    import json
+except ImportError:
+    json = None
+
+try:
+    import multiprocessing
+    import multiprocessing.pool
+except ImportError:
+    multiprocessing = None
 
 from pgr import sig
-from google.appengine.ext import webapp
+
+# GAE is optional, without it handlers are used by pgr.server.RpcApplication
+try:
+    from google.appengine.ext import webapp
+    _RequestHandler = webapp.RequestHandler
+except ImportError:
+    _RequestHandler = object
 
 
 class Types:
@@ -285,129 +496,1485 @@ class Types:
         return s
 
 
-class RpcHandler(webapp.RequestHandler):
+class Arrays:
+    " Containers for primitive arrays passed to service methods "
+
+    LIST = 'list'
+    ARRAY = 'array'
+    NUMPY = 'numpy'
+
+
+class Scopes:
+    " Lifecycle of service instances "
+
+    REQUEST = 'request'
+    THREAD = 'thread'
+    SINGLETON = 'singleton'
+
+
+class Executors:
+    " Executors of service methods "
+
+    INLINE = 'inline'
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+    ##
+    # sizes of pools, None for number of processors
+    THREAD_POOL_SIZE = 10
+    PROCESS_POOL_SIZE = None
+
+
+class Limits:
+    " Limits of decoded request, checked while request is read, None disables limit "
+
+    ##
+    # size of request body in bytes
+    MAX_BODY_SIZE = 10 * 1024 * 1024
+
+    ##
+    # number of tokens in request
+    MAX_TOKENS = 1000000
+
+    ##
+    # number of strings in string table
+    MAX_STRINGS = 100000
+
+    ##
+    # number of elements of one array
+    MAX_ARRAY_LENGTH = 1000000
+
+    ##
+    # nesting of objects and arrays
+    MAX_DEPTH = 100
+
+
+class _RpcLocalVar:
+    " Context variable of thread, used when contextvars module is not available "
+
+    def __init__(self):
+        self.__local = threading.local()
+
+    def get(self, default = None):
+        return getattr(self.__local, "value", default)
+
+    ##
+    # @return token to restore previous value
+    def set(self, value):
+        token = getattr(self.__local, "value", None)
+        self.__local.value = value
+        return token
+
+    def reset(self, token):
+        self.__local.value = token
+
+
+class _RpcContext(object):
+    " Values of processed request, custom values are stored in __dict__ "
+
+    __slots__ = ("request", "response", "requestText", "requestObject", "responseObject",
+                 "responseText", "exception", "serviceInstance", "methodInstance",
+                 "user", "sessionTicket", "profiler", "__dict__")
+
+    if contextvars != None:
+        __var__ = contextvars.ContextVar("pgr.ctx", default = None)
+    else:
+        __var__ = _RpcLocalVar()
+
+    def __init__(self, request = None, response = None, requestText = None):
+        self.request = request
+        self.response = response
+        self.requestText = requestText
+        self.requestObject = None
+        self.responseObject = None
+        self.responseText = None
+        self.exception = None
+        self.serviceInstance = None
+        self.methodInstance = None
+        self.user = None
+        self.sessionTicket = None
+        self.profiler = None
+
+    ##
+    # @return context of current request, new context is bound when there is no request
+    @staticmethod
+    def current():
+        ctx = _RpcContext.__var__.get()
+        if ctx == None:
+            ctx = _RpcContext()
+            _RpcContext.__var__.set(ctx)
+        return ctx
+
+    ##
+    # @param ctx context of started request
+    # @return token for release
+    @staticmethod
+    def bind(ctx):
+        return _RpcContext.__var__.set(ctx)
+
+    ##
+    # unbind context of finished request, so its values can be freed
+    # @param token token returned by bind
+    @staticmethod
+    def release(token):
+        _RpcContext.__var__.reset(token)
+
+    ##
+    # call function with context bound, used to pass context to other threads
+    # @param ctx context
+    # @param function called function
+    # @param args function arguments
+    # @return function return value
+    @staticmethod
+    def call(ctx, function, args):
+        token = _RpcContext.bind(ctx)
+        try:
+            return function(*args)
+        finally:
+            _RpcContext.release(token)
+
+
+class _RpcContextProxy(object):
+    " RpcHandler.ctx, gives access to context of current request "
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        return getattr(_RpcContext.current(), name)
+
+    def __setattr__(self, name, value):
+        setattr(_RpcContext.current(), name, value)
+
+    def __delattr__(self, name):
+        delattr(_RpcContext.current(), name)
+
+
+class RpcHandler(_RequestHandler):
     " Handler for GWT rpc "
 
     ##
-    # Local thread storage, use this field to access (or storing) processing
-    # variables from interceptors or service implementation.
+    # Context of current request, use this field to access (or storing) processing
+    # variables from interceptors or service implementation. Context is bound for
+    # time of post (contextvars or thread local) and released when request is finished.
     # Accessible properties:
-    #    request, requestText, requestObject (_RpcRequest) ,response, responseObject, responseText
-    ctx = threading.local()
+    #    request, requestText, requestObject (_RpcRequest) ,response, responseObject, responseText,
+    #    exception, serviceInstance, methodInstance, user
+    ctx = _RpcContextProxy()
 
     ##
-    # set of interceptors on request processing
+    # directory with GWT serialization policy files (.gwt.rpc), required when
+    # client elides type names
+    POLICY_DIR = "static"
+
+    ##
+    # readiness signal, set after successful warmUp
+    ready = threading.Event()
+
+    ##
+    # services interfaces names prepared by warmUp
+    __services = []
+
+    ##
+    # packages (module names prefixes) of services and VOs which can be imported on request,
+    # registered services and types from pgr.sig are always allowed, None allows all packages
+    ALLOWED_PACKAGES = ()
+
+    ##
+    # collect per method statistics, see statistics()
+    STATS = True
+
+    ##
+    # directory of profiler dumps, None disables profiling
+    PROFILE_DIR = None
+
+    ##
+    # part (0 - 1) of requests profiled at random
+    PROFILE_SAMPLE = 0.0
+
+    ##
+    # default duration of request in seconds, above which method is profiled on next call,
+    # None for no threshold, can be set per method by __profile__ property of service class
+    PROFILE_THRESHOLD = None
+
+    # guards changes of interceptors and services lists
+    __lock = threading.Lock()
+
+    ##
+    # set of interceptors on request processing, list of tuples (interceptor, services or None)
     __interceptors__ = []
 
+    ##
+    # interceptors methods called by core module
+    __hookNames__ = ("beforeRequestDecode", "afterRequestDecode", "beforeResponseDecode",
+                     "afterResponseDecode", "beforeExceptionDecode", "afterExceptionDecode",
+                     "beforeEvaluate", "afterEvaluate")
+
+    ##
+    # chains of not scoped interceptors methods, used when service method is not known yet,
+    # method name as key and tuple of bound methods as value
+    __hooks__ = dict()
+
     ##
     # request processing start point
     def post(self):
-
-        RpcHandler.ctx.request = self.request
-        RpcHandler.ctx.response = self.response
+        ctx = _RpcContext(self.request, self.response)
+        token = _RpcContext.bind(ctx)
         req = None
+        if _RpcProfiler.sampled():
+            ctx.profiler = _RpcProfiler()
 
         try:
-            rr = _RpcRequestReader()
-            rw = _RpcResponseWriter()
+            try:
+                rr = _RpcRequestReader()
+
+                RpcHandler._callInterceptors("beforeRequestDecode")
+
+                start = time.time()
+                req = rr.readRequest(self.request.body)
+                req.decodeTime = time.time() - start
+                req.requestSize = len(self.request.body)
+                resp = self._respond(req)
 
-            RpcHandler._callInterceptors("beforeRequestDecode")
+            except _RpcException, inst:
+                resp = self._respondException(inst, req)
 
-            req = rr.readRequest(self.request.body)
-            RpcHandler.ctx.requestObject = req
+            self._writeResponse(resp)
+        finally:
+            if ctx.profiler != None:
+                ctx.profiler.finish(req)
+            _RpcContext.release(token)
 
-            RpcHandler._callInterceptors("afterRequestDecode")
+    ##
+    # evaluate decoded request and encode its response
+    # @param req request object
+    # @return response string
+    def _respond(self, req):
+        ctx = _RpcContext.current()
+        ctx.requestObject = req
+
+        RpcHandler._callInterceptors("afterRequestDecode")
+
+        # method which was slow is profiled on next call, dump is kept if it is slow again
+        profiler = None
+        dispatch = req.dispatch
+        if dispatch.slow and ctx.profiler == None and RpcHandler.PROFILE_DIR != None:
+            dispatch.slow = False
+            profiler = _RpcProfiler()
+        try:
+            start = time.time()
             val = req.evaluate()
+            evaluated = time.time()
             RpcHandler._callInterceptors("beforeResponseDecode")
 
-            resp = rw.encodeResponse(val, req)
-            RpcHandler.ctx.responseText = resp
+            encoded = time.time()
+            if req.cachedResponse != None:
+                resp = req.cachedResponse
+            else:
+                resp = _RpcResponseWriter().encodeResponse(val, req)
+                if req.cacheKey != None:
+                    req.responseCache.put(req.cacheKey, val, resp)
+            ctx.responseText = resp
+            finished = time.time()
+        finally:
+            if profiler != None:
+                profiler.stop()
+
+        duration = req.decodeTime + finished - start
+        if dispatch.profileThreshold != None and duration > dispatch.profileThreshold:
+            if profiler != None:
+                profiler.finish(req)
+            else:
+                dispatch.slow = True
 
-            RpcHandler._callInterceptors("afterResponseDecode")
+        req.evaluateTime = evaluated - start
+        req.encodeTime = finished - encoded
+        if RpcHandler.STATS:
+            _RpcStats.forRequest(req).add(req.decodeTime, req.evaluateTime,
+                req.encodeTime, req.requestSize, len(resp))
 
-            self.response.out.write(resp)
+        RpcHandler._callInterceptors("afterResponseDecode")
+        return resp
 
-        except _RpcException, inst:
-            logging.warning(inst)
-            RpcHandler.ctx.exception = inst
-            RpcHandler._callInterceptors("beforeExceptionDecode")
-            resp = rw.encodeResponse(inst, req, True)
-            RpcHandler.ctx.responseText = resp
-            RpcHandler._callInterceptors("afterExceptionDecode")
-            self.response.out.write(resp)
+    ##
+    # @param inst exception
+    # @param req request object or None if request was not decoded
+    # @return response string with exception
+    def _respondException(self, inst, req):
+        logging.warning(inst)
+        ctx = _RpcContext.current()
+        ctx.exception = inst
+        RpcHandler._callInterceptors("beforeExceptionDecode")
+        resp = _RpcResponseWriter().encodeResponse(inst, req, True)
+        ctx.responseText = resp
+        if RpcHandler.STATS and req != None and req.dispatch != None:
+            _RpcStats.forRequest(req).addError()
+        RpcHandler._callInterceptors("afterExceptionDecode")
+        return resp
+
+    ##
+    # write response to output as UTF-8 bytes, response built as str is written as is
+    # (unicode is encoded to a new copy)
+    # @param resp response string
+    def _writeResponse(self, resp):
+        if isinstance(resp, unicode):
+            resp = resp.encode("utf-8")
+        self.response.out.write(resp)
+
+    ##
+    # @return statistics of service methods, dict with "service.method" name as key,
+    # see _RpcStats.snapshot for values
+    @staticmethod
+    def statistics():
+        return _RpcStats.snapshotAll()
+
+    ##
+    # clear statistics of all service methods
+    @staticmethod
+    def resetStatistics():
+        _RpcStats.clear()
 
     ##
     # call interceptors on main proccessing points
     # @param methodName name of interceptor method
     @staticmethod
     def _callInterceptors(methodName):
-        if len(RpcHandler.__interceptors__) > 0:
-            for interceptor in RpcHandler.__interceptors__:
-                if methodName in interceptor.__class__.__dict__:
-                    method = getattr(interceptor, methodName)
-                    method.__call__()
+        req = _RpcContext.current().requestObject
+        if req != None and req.dispatch != None:
+            hooks = req.dispatch.hooksFor(methodName)
+        else:
+            hooks = RpcHandler.__hooks__.get(methodName)
+            if hooks == None:
+                hooks = RpcHandler.__hooks__[methodName] = RpcHandler._interceptorHooks(methodName)
+        for hook in hooks:
+            hook()
 
     ##
     # @param interceptor new interceptor
+    # @param services list of services interfaces names ("pkg.Service") or services methods
+    #        names ("pkg.Service.method") intercepted by interceptor, None for all services
+    @staticmethod
+    def addInterceptr(intereptor, services = None):
+        if services != None:
+            services = frozenset(services)
+
+        # lists are replaced, not modified, so requests read them without locking
+        RpcHandler.__lock.acquire()
+        try:
+            RpcHandler.__interceptors__ = RpcHandler.__interceptors__ + [(intereptor, services)]
+
+            hooks = dict()
+            for name in RpcHandler.__hookNames__:
+                hooks[name] = RpcHandler._interceptorHooks(name)
+            RpcHandler.__hooks__ = hooks
+            _RpcMethod.clear()
+        finally:
+            RpcHandler.__lock.release()
+
+    ##
+    # release all singleton and thread scoped service instances (called also on exit)
+    @staticmethod
+    def shutdown():
+        _RpcExecutors.shutdown()
+        _RpcInstances.shutdown()
+
+    ##
+    # @param serviceIntfName service interface name prepared by warmUp
+    @staticmethod
+    def registerService(serviceIntfName):
+        RpcHandler.__lock.acquire()
+        try:
+            if serviceIntfName not in RpcHandler.__services:
+                RpcHandler.__services = RpcHandler.__services + [serviceIntfName]
+        finally:
+            RpcHandler.__lock.release()
+
+    ##
+    # @return tuple of registered services interfaces names
+    @staticmethod
+    def registeredServices():
+        return tuple(RpcHandler.__services)
+
+    ##
+    # import and validate all types from pgr.sig.__signatures__ and registered services,
+    # prepare codecs and methods dispatch, then set ready event
+    # @param services list of services interfaces names, prepared with registered services
+    # @param startExecutors start pools of executors declared by services (see startExecutors)
+    @staticmethod
+    def warmUp(services = (), startExecutors = True):
+        for name in services:
+            RpcHandler.registerService(name)
+        _RpcWarmUp().run(RpcHandler.__services)
+        if startExecutors:
+            RpcHandler.startExecutors()
+        RpcHandler.ready.set()
+
+    ##
+    # start pools of executors declared by prepared service methods, pools are started
+    # before requests are handled (process pool forks, so it must not be started from
+    # request thread); call it again in every process forked after warm-up
+    @staticmethod
+    def startExecutors():
+        _RpcExecutors.start(_RpcMethod.executors())
+
+    ##
+    # @param methodName name of interceptor method
+    # @param serviceIntfName service interface name, None for not scoped interceptors only
+    # @param serviceMethodName service method name
+    # @return tuple of bound interceptors methods
     @staticmethod
-    def addInterceptr(intereptor):
-        RpcHandler.__interceptors__.append(intereptor)
+    def _interceptorHooks(methodName, serviceIntfName = None, serviceMethodName = None):
+        hooks = []
+        for interceptor, services in RpcHandler.__interceptors__:
+            if services != None:
+                if serviceIntfName == None:
+                    continue
+                if serviceIntfName not in services and \
+                        serviceIntfName + "." + serviceMethodName not in services:
+                    continue
+            # getattr finds also methods inherited from base classes
+            hook = getattr(interceptor, methodName, None)
+            if hook != None:
+                hooks.append(hook)
+        return tuple(hooks)
+
+
+class RpcWarmUpHandler(_RequestHandler):
+    " Handler of warm-up request (e.g. /_ah/warmup), answers 503 until warm-up succeeds "
+
+    def get(self):
+        if not RpcHandler.ready.isSet():
+            try:
+                # process pool is not forked from request thread, it must be started
+                # by application on start (thread pools are started on first call)
+                RpcHandler.warmUp(startExecutors = False)
+            except _RpcException, inst:
+                logging.error(inst)
+                self.response.set_status(503)
+                self.response.out.write("not ready")
+                return
+        self.response.out.write("ready")
+
+
+class RpcStatsHandler(_RequestHandler):
+    " Handler of statistics request (e.g. /pgr/stats), answers RpcHandler.statistics() as json "
+
+    def get(self):
+        stats = RpcHandler.statistics()
+        if json != None:
+            self.response.out.write(json.dumps(stats, sort_keys = True))
+        else:
+            self.response.out.write(repr(stats))
+
+
+class RpcBatchHandler(RpcHandler):
+    " Handler for batch of GWT rpc calls sharing one string table "
+
+    ##
+    # evaluate calls concurrently, each call in own thread
+    CONCURRENT = False
+
+    ##
+    # separator of calls responses in batch response
+    RESPONSE_SEPARATOR = "\n"
+
+    ##
+    # batch processing start point
+    def post(self):
+        token = _RpcContext.bind(_RpcContext(self.request, self.response))
+        try:
+            try:
+                RpcHandler._callInterceptors("beforeRequestDecode")
+                start = time.time()
+                requests = _RpcRequestReader().readBatch(self.request.body)
+                # calls share decode time and size of batch request
+                decodeTime = (time.time() - start) / max(len(requests), 1)
+                for req in requests:
+                    req.decodeTime = decodeTime
+                    req.requestSize = len(self.request.body)
+            except _RpcException, inst:
+                self._writeResponse(self._respondException(inst, None))
+                return
+
+            if self.CONCURRENT and len(requests) > 1:
+                responses = self.__respondConcurrently(requests)
+            else:
+                responses = []
+                for req in requests:
+                    responses.append(self.__respondSafely(req))
+
+            self._writeResponse(self.RESPONSE_SEPARATOR.join(responses))
+        finally:
+            _RpcContext.release(token)
+
+    def __respondSafely(self, req):
+        if req.error != None:
+            return self._respondException(req.error, req)
+        try:
+            return self._respond(req)
+        except _RpcException, inst:
+            return self._respondException(inst, req)
+
+    def __respondConcurrently(self, requests):
+        responses = [None] * len(requests)
+        ctx = _RpcContext.current()
+
+        def respond(i):
+            responses[i] = self.__respondSafely(requests[i])
+
+        threads = []
+        for i in range(len(requests)):
+            # every call has own context
+            callCtx = _RpcContext(ctx.request, ctx.response, ctx.requestText)
+            t = threading.Thread(target = _RpcContext.call, args = (callCtx, respond, (i,)))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        return responses
 
 
 class _RpcRequest:
     " Request object "
 
+    ##
+    # supported range of GWT rpc protocol versions
+    MIN_VERSION = 3
+    MAX_VERSION = 7
+
+    ##
+    # request flags
+    FLAG_ELIDE_TYPE_NAMES = 0x1
+    FLAG_RPC_TOKEN_INCLUDED = 0x2
+
     version = 0;
     flags = 0;
 
     moduleBaseURL = None
     strongName = None
+    rpcToken = None
     serviceIntfName = None
     serviceMethodName = None
     parameterTypes = None
     parameterValues = None
     returnType = None
 
+    ##
+    # response cache of method, key of request in cache and cached response text
+    responseCache = None
+    cacheKey = None
+    cachedResponse = None
+
+    ##
+    # resolved service method (_RpcMethod)
+    dispatch = None
+
+    ##
+    # error of method resolution (_RpcException), call is answered with it
+    error = None
+
+    ##
+    # decode, evaluate and encode times in seconds and size of request text, for statistics
+    decodeTime = 0
+    evaluateTime = 0
+    encodeTime = 0
+    requestSize = 0
+
     ##
     # excecute target service method
     # @return:
     def evaluate(self):
-        classe = _RpcUtils.class_for_name(self.serviceIntfName)
+        if self.dispatch == None:
+            self.dispatch = _RpcMethod.forName(self.serviceIntfName, self.serviceMethodName)
+        dispatch = self.dispatch
+        dispatch.checkParameters(self.parameterValues)
+        self.returnType = dispatch.returnType
+
+        instance = _RpcInstances.get(dispatch.classe, dispatch.scope)
+        try:
+            method = new.instancemethod(dispatch.function, instance, dispatch.classe)
+
+            ctx = _RpcContext.current()
+            ctx.serviceInstance = instance
+            ctx.methodInstance = method
+
+            for hook in dispatch.hooks["beforeEvaluate"]:
+                hook()
+
+            # lookup after interceptors, so authorization is checked also for cached responses
+            self.responseCache = dispatch.responseCache
+            entry = None
+            if self.responseCache != None:
+                self.cacheKey = self.responseCache.keyFor(self)
+                if self.cacheKey != None:
+                    entry = self.responseCache.get(self.cacheKey)
+
+            if entry != None:
+                val, self.cachedResponse = entry
+            elif dispatch.executor == Executors.INLINE:
+                val = dispatch.function(instance, *self.parameterValues)
+            else:
+                val = _RpcExecutors.call(dispatch, instance, self.parameterValues)
+            ctx.responseObject = val
+            for hook in dispatch.hooks["afterEvaluate"]:
+                hook()
+        finally:
+            if dispatch.scope == Scopes.REQUEST:
+                _RpcInstances.release(instance)
 
-        if self.serviceMethodName not in classe.__dict__:
-            raise _RpcException(__err_msg__["met.nf"] %(self.serviceIntfName, self.serviceMethodName))
+        return val
 
-        serialization = {}
-        methods = []
 
-        _RpcUtils.multi_inherit_serialization(classe, serialization, methods)
+class _RpcExecutors:
+    " Pools of threads and processes for service methods declared in __executor__ property "
 
-        if len(serialization) > 0:
-            if self.serviceMethodName in serialization:
-                self.returnType = serialization[self.serviceMethodName]
-            else:
-                raise _RpcException(__err_msg__["ser.met.nf"] %(self.serviceIntfName, self.serviceMethodName))
-        else:
-            raise _RpcException(__err_msg__["ser.nf"] %(self.serviceIntfName))
+    __pools__ = dict()
+    __lock__ = threading.Lock()
+
+    ##
+    # call service method in pool, wait for result
+    # @param dispatch resolved service method
+    # @param instance service instance (used by thread pool)
+    # @param parameterValues parameters values
+    # @return service method return value
+    @staticmethod
+    def call(dispatch, instance, parameterValues):
+        pool = _RpcExecutors.__pools__.get(dispatch.executor)
+        if pool == None:
+            # thread pool doesn't fork, so it can be started on first call
+            if dispatch.executor != Executors.THREAD:
+                raise _RpcException(__err_msg__["exe.nst"] %(dispatch.serviceIntfName, dispatch.name))
+            pool = _RpcExecutors.__createPool(dispatch.executor)
+
+        if dispatch.executor == Executors.THREAD:
+            return pool.apply(_RpcContext.call, (_RpcContext.current(), dispatch.function,
+                (instance,) + tuple(parameterValues)))
+
+        # worker process resolves method by name, only parameters are pickled
+        return pool.apply(_evaluateInProcess,
+            (dispatch.serviceIntfName, dispatch.name, tuple(parameterValues)))
+
+    ##
+    # start pools of executors
+    # @param executors executors (Executors.THREAD or Executors.PROCESS)
+    @staticmethod
+    def start(executors):
+        for executor in executors:
+            if executor not in _RpcExecutors.__pools__:
+                _RpcExecutors.__createPool(executor)
+
+    ##
+    # close all pools
+    @staticmethod
+    def shutdown():
+        _RpcExecutors.__lock__.acquire()
+        try:
+            pools = _RpcExecutors.__pools__.values()
+            _RpcExecutors.__pools__ = dict()
+        finally:
+            _RpcExecutors.__lock__.release()
+
+        for pool in pools:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def __createPool(executor):
+        _RpcExecutors.__lock__.acquire()
+        try:
+            pool = _RpcExecutors.__pools__.get(executor)
+            if pool == None:
+                if executor == Executors.THREAD:
+                    pool = multiprocessing.pool.ThreadPool(Executors.THREAD_POOL_SIZE)
+                else:
+                    pool = multiprocessing.Pool(Executors.PROCESS_POOL_SIZE)
+                _RpcExecutors.__pools__[executor] = pool
+            return pool
+        finally:
+            _RpcExecutors.__lock__.release()
+
+
+class _RpcWarmUp:
+    " Imports, validates and prepares services and VOs before first request "
+
+    __primitives__ = frozenset([Types.VOID, Types.INT, Types.LONG, Types.SHORT, Types.FLOAT,
+        Types.DOUBLE, Types.BOOLEAN, Types.CHAR, Types.BYTE, Types.STRING])
+
+    def __init__(self):
+        self.errors = []
+        self.__checked = set()
+
+    ##
+    # @param services list of services interfaces names
+    def run(self, services):
+        if sig.__signatures__ == None:
+            raise _RpcException(__err_msg__["sig.nf"])
+        for name in sorted(sig.__signatures__):
+            self.__checkType(name, "pgr.sig")
+        for name in services:
+            self.__checkService(name)
+        if len(self.errors) > 0:
+            raise _RpcException(__err_msg__["wrm.err"] %(len(self.errors), "\n".join(self.errors)))
+
+    def __checkService(self, name):
+        try:
+            classe = _RpcUtils.class_for_name(name)
+            serialization, methods = _RpcUtils.serialization_plan(classe)
+            if len(methods) == 0:
+                raise _RpcException(__err_msg__["ser.nf"] %(name))
+            for method in methods:
+                _RpcMethod.forName(name, method)
+                self.__checkType(serialization[method], name + "." + method)
+        except _RpcException, inst:
+            self.errors.append(str(inst))
+
+    ##
+    # check that type can be serialized, prepare its decoder and encoding plan
+    # @param t type name
+    # @param owner name of field, method or module declaring the type
+    def __checkType(self, t, owner):
+        if t in self.__primitives__ or t in self.__checked:
+            return
+        self.__checked.add(t)
+        try:
+            if t not in sig.__signatures__:
+                raise _RpcException(__err_msg__["sig.tnf"] %(t))
+            if t.startswith("["):
+                self.__checkType(Types.getTypeFromArrayType(t), owner)
+                _RpcResponseWriter.compilePlan(t)
+                return
+            # GWT types have no python implementation
+            if t.startswith("java.") or t.startswith("com.google.gwt."):
+                return
+
+            classe = _RpcUtils.class_for_name(t)
+            serialization, fields = _RpcUtils.serialization_plan(classe)
+            for fname in fields:
+                self.__checkType(serialization[fname], t + "." + fname)
+            _RpcRequestReader.compileDecoder(t)
+            _RpcResponseWriter.compilePlan(t)
+        except _RpcException, inst:
+            self.errors.append("%s: %s" %(owner, inst))
+
+
+class _RpcInstances:
+    " Provider of service instances, according to __scope__ property of service class "
+
+    ##
+    # names of optional service methods called after instance creation and before its release
+    CREATE_HOOK = "onCreate"
+    SHUTDOWN_HOOK = "onShutdown"
+
+    __singletons__ = dict()
+    __local__ = threading.local()
+    ##
+    # created singleton instances, released on shutdown
+    __created__ = []
+    ##
+    # thread instances of live threads (weak references), released on shutdown
+    __threads__ = weakref.WeakValueDictionary()
+    __threadIds__ = itertools.count()
+    __lock__ = threading.Lock()
+    __atexit__ = False
+
+    ##
+    # @param classe service class
+    # @param scope scope of instance (Scopes)
+    # @return service instance
+    @staticmethod
+    def get(classe, scope):
+        if scope == Scopes.REQUEST:
+            return _RpcInstances.__create(classe)
+
+        if scope == Scopes.SINGLETON:
+            instance = _RpcInstances.__singletons__.get(classe)
+            if instance == None:
+                _RpcInstances.__lock__.acquire()
+                try:
+                    instance = _RpcInstances.__singletons__.get(classe)
+                    if instance == None:
+                        instance = _RpcInstances.__create(classe)
+                        _RpcInstances.__track(instance)
+                        _RpcInstances.__singletons__[classe] = instance
+                finally:
+                    _RpcInstances.__lock__.release()
+            return instance
+
+        # instances are held only by thread, so they are released when thread ends
+        local = _RpcInstances.__local__
+        thread = getattr(local, "thread", None)
+        if thread == None:
+            thread = local.thread = _RpcThreadInstances()
+            _RpcInstances.__lock__.acquire()
+            try:
+                _RpcInstances.__threads__[_RpcInstances.__threadIds__.next()] = thread
+                _RpcInstances.__registerAtexit()
+            finally:
+                _RpcInstances.__lock__.release()
+        instance = thread.instances.get(classe)
+        if instance == None:
+            instance = _RpcInstances.__create(classe)
+            thread.instances[classe] = instance
+        return instance
+
+    ##
+    # call shutdown hook of service instance
+    # @param instance service instance
+    @staticmethod
+    def release(instance):
+        hook = getattr(instance, _RpcInstances.SHUTDOWN_HOOK, None)
+        if hook != None:
+            hook()
+
+    ##
+    # release all singleton and thread instances
+    @staticmethod
+    def shutdown():
+        _RpcInstances.__lock__.acquire()
+        try:
+            instances = _RpcInstances.__created__
+            _RpcInstances.__created__ = []
+            _RpcInstances.__singletons__ = dict()
+            _RpcInstances.__local__ = threading.local()
+            threads = _RpcInstances.__threads__.values()
+            _RpcInstances.__threads__ = weakref.WeakValueDictionary()
+        finally:
+            _RpcInstances.__lock__.release()
+
+        for thread in threads:
+            thread.release()
+        instances.reverse()
+        _RpcInstances.releaseAll(instances)
+
+    ##
+    # call shutdown hooks of instances, errors are only logged
+    # @param instances list of service instances
+    @staticmethod
+    def releaseAll(instances):
+        for instance in instances:
+            try:
+                _RpcInstances.release(instance)
+            except Exception, inst:
+                logging.exception(inst)
 
+    @staticmethod
+    def __create(classe):
         instance = new.instance(classe)
-        method = getattr(instance, self.serviceMethodName)
+        hook = getattr(instance, _RpcInstances.CREATE_HOOK, None)
+        if hook != None:
+            hook()
+        return instance
+
+    # must be called with lock acquired
+    @staticmethod
+    def __track(instance):
+        _RpcInstances.__created__.append(instance)
+        _RpcInstances.__registerAtexit()
 
-        RpcHandler.ctx.serviceInstance = instance
-        RpcHandler.ctx.methodInstance = method
+    # must be called with lock acquired
+    @staticmethod
+    def __registerAtexit():
+        if not _RpcInstances.__atexit__:
+            atexit.register(_RpcInstances.shutdown)
+            _RpcInstances.__atexit__ = True
 
-        RpcHandler._callInterceptors("beforeEvaluate")
-        val =  method.__call__(*self.parameterValues)
-        RpcHandler.ctx.responseObject = val
-        RpcHandler._callInterceptors("afterEvaluate")
 
-        return val
+class _RpcThreadInstances:
+    " Thread scope instances of one thread, released when thread ends or on shutdown "
+
+    def __init__(self):
+        # service class as key
+        self.instances = dict()
+
+    def release(self):
+        instances = self.instances.values()
+        self.instances = dict()
+        _RpcInstances.releaseAll(instances)
+
+    # called when thread local storage of ended thread is dropped
+    def __del__(self):
+        self.release()
+
+
+class _RpcMethod:
+    " Resolved service method, all informations needed for method call "
+
+    ##
+    # registry of resolved methods, tuple of (service interface name, method name) as key
+    __methods__ = dict()
+
+    ##
+    # @param serviceIntfName service interface name
+    # @param serviceMethodName service method name
+    def __init__(self, serviceIntfName, serviceMethodName):
+        classe = _RpcUtils.class_for_name(serviceIntfName)
+
+        # getattr finds also methods inherited from base classes
+        function = getattr(classe, serviceMethodName, None)
+        if function == None or not hasattr(function, "im_func"):
+            raise _RpcException(__err_msg__["met.nf"] %(serviceIntfName, serviceMethodName))
+
+        serialization, methods = _RpcUtils.serialization_plan(classe)
+        if len(serialization) == 0:
+            raise _RpcException(__err_msg__["ser.nf"] %(serviceIntfName))
+        if serviceMethodName not in serialization:
+            raise _RpcException(__err_msg__["ser.met.nf"] %(serviceIntfName, serviceMethodName))
+
+        self.serviceIntfName = serviceIntfName
+        self.name = serviceMethodName
+        self.classe = classe
+        self.function = function.im_func
+        self.returnType = serialization[serviceMethodName]
+
+        # parameters count without self, None if method accepts variable number of parameters
+        code = self.function.func_code
+        self.paramCount = code.co_argcount - 1
+        self.minParamCount = self.paramCount - len(self.function.func_defaults or ())
+        if code.co_flags & 0x04:
+            self.paramCount = None
+
+        perm = getattr(classe, "__perm__", None)
+        self.perm = None
+        if perm != None and serviceMethodName in perm:
+            self.perm = perm[serviceMethodName]
+
+        self.arrays = Arrays.LIST
+        arrays = getattr(classe, "__arrays__", None)
+        if arrays != None and serviceMethodName in arrays:
+            self.arrays = arrays[serviceMethodName]
+            if self.arrays == Arrays.NUMPY and numpy == None:
+                raise _RpcException(__err_msg__["np.nf"] %(serviceIntfName, serviceMethodName))
+
+        self.scope = getattr(classe, "__scope__", Scopes.REQUEST)
+        if self.scope not in (Scopes.REQUEST, Scopes.THREAD, Scopes.SINGLETON):
+            raise _RpcException(__err_msg__["scp.ns"] %(self.scope, serviceIntfName))
+
+        self.executor = Executors.INLINE
+        executors = getattr(classe, "__executor__", None)
+        if executors != None and serviceMethodName in executors:
+            self.executor = executors[serviceMethodName]
+            if self.executor not in (Executors.INLINE, Executors.THREAD, Executors.PROCESS):
+                raise _RpcException(__err_msg__["exe.ns"] %(self.executor, serviceIntfName, serviceMethodName))
+            if self.executor != Executors.INLINE and multiprocessing == None:
+                raise _RpcException(__err_msg__["exe.ns"] %(self.executor, serviceIntfName, serviceMethodName))
+
+        self.responseCache = _RpcResponseCache.forMethod(classe, serviceIntfName, serviceMethodName)
+
+        self.profileThreshold = RpcHandler.PROFILE_THRESHOLD
+        thresholds = getattr(classe, "__profile__", None)
+        if thresholds != None and serviceMethodName in thresholds:
+            self.profileThreshold = thresholds[serviceMethodName]
+        # last call was above threshold, next call is profiled
+        self.slow = False
+
+        # interceptors chains of method, interceptor method name as key
+        self.hooks = dict()
+        for name in RpcHandler.__hookNames__:
+            self.hooks[name] = RpcHandler._interceptorHooks(name, serviceIntfName, serviceMethodName)
+
+    ##
+    # @param serviceIntfName service interface name
+    # @param serviceMethodName service method name
+    # @return resolved method, created on first use
+    @staticmethod
+    def forName(serviceIntfName, serviceMethodName):
+        method = _RpcMethod.__methods__.get((serviceIntfName, serviceMethodName))
+        if method == None:
+            method = _RpcMethod(serviceIntfName, serviceMethodName)
+            _RpcMethod.__methods__[(serviceIntfName, serviceMethodName)] = method
+        return method
+
+    ##
+    # @param methodName name of interceptor method
+    # @return tuple of interceptors methods called for this service method
+    def hooksFor(self, methodName):
+        hooks = self.hooks.get(methodName)
+        if hooks == None:
+            hooks = self.hooks[methodName] = RpcHandler._interceptorHooks(
+                methodName, self.serviceIntfName, self.name)
+        return hooks
+
+    ##
+    # @return set of executors, other than inline, declared by resolved methods
+    @staticmethod
+    def executors():
+        executors = set()
+        for method in _RpcMethod.__methods__.values():
+            if method.executor != Executors.INLINE:
+                executors.add(method.executor)
+        return executors
+
+    ##
+    # drop all resolved methods (e.g. after interceptors change)
+    @staticmethod
+    def clear():
+        _RpcMethod.__methods__ = dict()
+
+    ##
+    # @param values parameters values
+    def checkParameters(self, values):
+        if len(values) < self.minParamCount or \
+                (self.paramCount != None and len(values) > self.paramCount):
+            raise _RpcException(__err_msg__["par.ne"] %(self.serviceIntfName, self.name, len(values)))
+
+
+class _RpcResponseCache:
+    " LRU cache of encoded responses of service method declared in __cache__ property "
+
+    ##
+    # caches of methods, tuple of (service interface name, method name) as key
+    __caches__ = dict()
+    __lock__ = threading.Lock()
+
+    ##
+    # @param ttl time to live of response in seconds
+    # @param size maximal number of cached responses
+    # @param perRole is role of authorized user a part of key
+    def __init__(self, ttl, size, perRole):
+        self.ttl = ttl
+        self.size = size
+        self.perRole = perRole
+        self.__entries = dict()
+        # circular list of entries [prev, next, key, expires, value, text], most recently used at the end
+        self.__root = []
+        self.__root[:] = [self.__root, self.__root, None, None, None, None]
+        self.__lock = threading.Lock()
+
+    ##
+    # @param classe service class
+    # @param serviceIntfName service interface name
+    # @param serviceMethodName service method name
+    # @return cache of method or None if method is not cacheable
+    @staticmethod
+    def forMethod(classe, serviceIntfName, serviceMethodName):
+        declared = getattr(classe, "__cache__", None)
+        if declared == None or serviceMethodName not in declared:
+            return None
+
+        name = (serviceIntfName, serviceMethodName)
+        cache = _RpcResponseCache.__caches__.get(name)
+        if cache == None:
+            _RpcResponseCache.__lock__.acquire()
+            try:
+                cache = _RpcResponseCache.__caches__.get(name)
+                if cache == None:
+                    d = declared[serviceMethodName]
+                    if not isinstance(d, tuple) or len(d) not in (2, 3) or \
+                            not isinstance(d[0], (int, long, float)) or d[0] <= 0 or \
+                            not isinstance(d[1], (int, long)) or d[1] <= 0:
+                        raise _RpcException(__err_msg__["cch.ns"] %(d, serviceIntfName, serviceMethodName))
+                    cache = _RpcResponseCache(d[0], d[1], len(d) > 2 and d[2])
+                    _RpcResponseCache.__caches__[name] = cache
+            finally:
+                _RpcResponseCache.__lock__.release()
+        return cache
+
+    ##
+    # @param req request object
+    # @return key of request or None if parameters values can't be a part of key
+    def keyFor(self, req):
+        role = None
+        if self.perRole:
+            user = _RpcContext.current().user
+            if user != None:
+                role = user.roles
+        values = _RpcUtils.freeze(req.parameterValues)
+        if values == None:
+            return None
+        key = (req.version, req.flags, req.strongName, role, values)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    ##
+    # @param key request key
+    # @return tuple of (value, response text) or None if response is not cached or expired
+    def get(self, key):
+        self.__lock.acquire()
+        try:
+            link = self.__entries.get(key)
+            if link == None:
+                return None
+            self.__unlink(link)
+            if link[3] < time.time():
+                del self.__entries[key]
+                return None
+            self.__linkLast(link)
+            return (link[4], link[5])
+        finally:
+            self.__lock.release()
+
+    ##
+    # @param key request key
+    # @param value service method return value
+    # @param text encoded response
+    def put(self, key, value, text):
+        self.__lock.acquire()
+        try:
+            link = self.__entries.get(key)
+            if link != None:
+                self.__unlink(link)
+            elif len(self.__entries) >= self.size:
+                oldest = self.__root[1]
+                self.__unlink(oldest)
+                del self.__entries[oldest[2]]
+            link = [None, None, key, time.time() + self.ttl, value, text]
+            self.__linkLast(link)
+            self.__entries[key] = link
+        finally:
+            self.__lock.release()
+
+    def __unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def __linkLast(self, link):
+        last = self.__root[0]
+        link[0] = last
+        link[1] = self.__root
+        last[1] = link
+        self.__root[0] = link
+
+
+class _RpcProfiler:
+    " Profiler of request, writes pstats dump and its text summary to RpcHandler.PROFILE_DIR "
+
+    ##
+    # number of rows of summary
+    SUMMARY_ROWS = 40
+
+    __count__ = 0
+
+    def __init__(self):
+        self.__profile = cProfile.Profile()
+        self.__stopped = False
+        self.__profile.enable()
+
+    ##
+    # @return True if request should be profiled, according to RpcHandler.PROFILE_SAMPLE
+    @staticmethod
+    def sampled():
+        return RpcHandler.PROFILE_DIR != None and RpcHandler.PROFILE_SAMPLE > 0 and \
+            random.random() < RpcHandler.PROFILE_SAMPLE
+
+    def stop(self):
+        if not self.__stopped:
+            self.__profile.disable()
+            self.__stopped = True
+
+    ##
+    # stop profiler and write dump, errors are only logged
+    # @param req request object or None if request was not decoded
+    def finish(self, req):
+        self.stop()
+        try:
+            self.__dump(req)
+        except Exception, inst:
+            logging.exception(inst)
+
+    def __dump(self, req):
+        method = "unknown"
+        params = ""
+        if req != None:
+            method = "%s.%s" %(req.serviceIntfName, req.serviceMethodName)
+            if req.parameterValues != None:
+                params = ", ".join([repr(v)[:100] for v in req.parameterValues])
+
+        _RpcProfiler.__count__ += 1
+        name = "%s-%s-%s-%s" %(time.strftime("%Y%m%d%H%M%S"), method, os.getpid(), _RpcProfiler.__count__)
+        path = os.path.join(RpcHandler.PROFILE_DIR, name)
+        self.__profile.dump_stats(path + ".pstats")
+
+        f = open(path + ".txt", "w")
+        try:
+            f.write("method: %s\nparameters: %s\n\n" %(method, params))
+            stats = pstats.Stats(path + ".pstats", stream = f)
+            stats.sort_stats("cumulative").print_stats(_RpcProfiler.SUMMARY_ROWS)
+        finally:
+            f.close()
+
+
+class _RpcHistogram:
+    " Histogram with exponential buckets, count of values in bucket for every upper bound "
+
+    ##
+    # @param first upper bound of first bucket, next bounds are doubled
+    # @param count number of buckets, last bucket has no upper bound
+    def __init__(self, first, count):
+        self.bounds = [first * 2 ** i for i in range(count - 1)]
+        self.buckets = [0] * count
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    # must be called with lock of _RpcStats acquired
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    ##
+    # @param p percent (0 - 100)
+    # @return upper bound of bucket with p percentile, max value for last bucket
+    def percentile(self, p):
+        rank = self.count * p / 100.0
+        seen = 0
+        for i in range(len(self.bounds)):
+            seen += self.buckets[i]
+            if seen >= rank and seen > 0:
+                return min(self.bounds[i], self.max)
+        return self.max
+
+    ##
+    # @return dict with count, mean, max, p50, p90, p99
+    def snapshot(self):
+        mean = 0
+        if self.count > 0:
+            mean = self.total / float(self.count)
+        return {"count": self.count, "mean": mean, "max": self.max,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99)}
+
+
+class _RpcStats:
+    " Statistics of service method, durations (ms) of decode, evaluate, encode and sizes of request and response "
+
+    ##
+    # statistics of methods, tuple of (service interface name, method name) as key
+    __stats__ = dict()
+    __lock__ = threading.Lock()
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.decode = _RpcHistogram(0.1, 20)
+        self.evaluate = _RpcHistogram(0.1, 20)
+        self.encode = _RpcHistogram(0.1, 20)
+        self.requestSize = _RpcHistogram(64, 20)
+        self.responseSize = _RpcHistogram(64, 20)
+        self.__lock = threading.Lock()
+
+    ##
+    # @param req request object
+    # @return statistics of request method
+    @staticmethod
+    def forRequest(req):
+        name = (req.serviceIntfName, req.serviceMethodName)
+        stats = _RpcStats.__stats__.get(name)
+        if stats == None:
+            _RpcStats.__lock__.acquire()
+            try:
+                stats = _RpcStats.__stats__.get(name)
+                if stats == None:
+                    stats = _RpcStats()
+                    _RpcStats.__stats__[name] = stats
+            finally:
+                _RpcStats.__lock__.release()
+        return stats
+
+    ##
+    # @param decode decode time in seconds
+    # @param evaluate evaluate time in seconds
+    # @param encode encode time in seconds
+    # @param requestSize size of request text
+    # @param responseSize size of response text
+    def add(self, decode, evaluate, encode, requestSize, responseSize):
+        self.__lock.acquire()
+        try:
+            self.calls += 1
+            self.decode.add(decode * 1000)
+            self.evaluate.add(evaluate * 1000)
+            self.encode.add(encode * 1000)
+            self.requestSize.add(requestSize)
+            self.responseSize.add(responseSize)
+        finally:
+            self.__lock.release()
+
+    def addError(self):
+        self.__lock.acquire()
+        try:
+            self.errors += 1
+        finally:
+            self.__lock.release()
+
+    ##
+    # @return dict with calls, errors and snapshots of histograms
+    def snapshot(self):
+        self.__lock.acquire()
+        try:
+            return {"calls": self.calls, "errors": self.errors,
+                    "decode": self.decode.snapshot(), "evaluate": self.evaluate.snapshot(),
+                    "encode": self.encode.snapshot(), "requestSize": self.requestSize.snapshot(),
+                    "responseSize": self.responseSize.snapshot()}
+        finally:
+            self.__lock.release()
+
+    ##
+    # @return dict of snapshots, with "service.method" name as key
+    @staticmethod
+    def snapshotAll():
+        snapshots = dict()
+        for name, stats in _RpcStats.__stats__.items():
+            snapshots["%s.%s" %name] = stats.snapshot()
+        return snapshots
+
+    @staticmethod
+    def clear():
+        _RpcStats.__lock__.acquire()
+        try:
+            _RpcStats.__stats__ = dict()
+        finally:
+            _RpcStats.__lock__.release()
 
 
 class _RpcException(Exception):
     " Base PGR exception "
     pass
 
+class _RpcCyclicValue(Exception):
+    " Value refers to itself, it can't be frozen to cache key "
+    pass
+
+class _RpcTokenCursor:
+    " Lazy cursor over request tokens, tokens are cut from request body only when read "
+
+    ##
+    # @param content request body (encoded string or unicode)
+    # @param separator token separator (unicode)
+    # @param encoding body encoding
+    # @param maxTokens maximal number of read tokens, None for no limit
+    def __init__(self, content, separator, encoding, maxTokens = None):
+        self.__content = content
+        self.__pos = 0
+        self.__tokensLeft = maxTokens
+        if isinstance(content, unicode):
+            self.__separator = separator
+            self.__encoding = None
+        else:
+            # utf-8 is self-synchronizing, so encoded separator can be found without decoding body
+            self.__separator = separator.encode(encoding)
+            self.__encoding = encoding
+        self.__separatorLen = len(self.__separator)
+
+    ##
+    # @return next raw token, numeric tokens don't need decoding
+    def next(self):
+        start, end = self.skip()
+        return self.__content[start:end]
+
+    ##
+    # move cursor over next token without materializing it
+    # @return tuple of (start, end) token offsets
+    def skip(self):
+        start = self.__pos
+        # body ends with separator, so cursor is at the end after last token
+        if start >= len(self.__content):
+            raise _RpcException(__err_msg__["req.eof"])
+        if self.__tokensLeft != None:
+            self.__take(1)
+        end = self.__content.find(self.__separator, start)
+        if end < 0:
+            end = len(self.__content)
+        self.__pos = end + self.__separatorLen
+        return (start, end)
+
+    ##
+    # @param count number of tokens
+    # @param tokenLen expected maximal length of token
+    # @return list of next raw tokens
+    def nextMany(self, count, tokenLen):
+        if count <= 0:
+            return []
+        if self.__tokensLeft != None:
+            self.__take(count)
+        start = self.__pos
+        # split only a window expected to hold all tokens, whole rest of body if window is too short
+        window = self.__content[start:start + count * (tokenLen + self.__separatorLen)]
+        tokens = window.split(self.__separator, count)
+        if len(tokens) <= count:
+            tokens = self.__content[start:].split(self.__separator, count)
+            if len(tokens) <= count:
+                raise _RpcException(__err_msg__["req.eof"])
+        tokens.pop()
+        self.__pos = start + sum(map(len, tokens)) + count * self.__separatorLen
+        return tokens
+
+    def __take(self, count):
+        self.__tokensLeft -= count
+        if self.__tokensLeft < 0:
+            raise _RpcException(__err_msg__["req.lim"] %("MAX_TOKENS", Limits.MAX_TOKENS))
+
+    ##
+    # @param span tuple of (start, end) token offsets
+    # @return decoded token
+    def decode(self, span):
+        token = self.__content[span[0]:span[1]]
+        if self.__encoding == None:
+            return token
+        return token.decode(self.__encoding)
+
+class _RpcSerializationPolicy:
+    " Type ids of GWT serialization policy file (<strong name>.gwt.rpc), used for elided type names "
+
+    ##
+    # cache of loaded policies, strong name as key
+    __policies__ = dict()
+
+    ##
+    # @param lines lines of policy file
+    def __init__(self, lines):
+        # type signature ("name/signature") as key and type id as value
+        self.typeIds = dict()
+        # type id as key and type signature as value
+        self.typeSignatures = dict()
+        # type id as key and class name as value, used for service interface and parameters types
+        self.classNames = dict()
+
+        for line in lines:
+            cols = [c.strip() for c in line.split(",")]
+            # older policy files have no type ids
+            if len(cols) < 7 or line.startswith("@"):
+                continue
+            self.classNames[cols[5]] = cols[0]
+            # service interface has "_" id, it is send instead of interface name
+            if cols[5] == "_":
+                continue
+            typeSignature = cols[0] + "/" + cols[6]
+            self.typeIds[typeSignature] = cols[5]
+            self.typeSignatures[cols[5]] = typeSignature
+
+    ##
+    # @param typeId type id send by client
+    # @return class name of type, or type id if it is not in policy (e.g. primitive type)
+    def className(self, typeId):
+        return self.classNames.get(typeId, typeId)
+
+    ##
+    # @param strongName strong name of policy send by client
+    # @return policy object
+    @staticmethod
+    def forStrongName(strongName):
+        policy = _RpcSerializationPolicy.__policies__.get(strongName)
+        if policy != None:
+            return policy
+
+        if strongName == None or not strongName.isalnum():
+            raise _RpcException(__err_msg__["pol.nf"] %(strongName))
+        try:
+            f = open(os.path.join(RpcHandler.POLICY_DIR, strongName + ".gwt.rpc"))
+            try:
+                policy = _RpcSerializationPolicy(f.readlines())
+            finally:
+                f.close()
+        except IOError, inst:
+            logging.exception(inst)
+            raise _RpcException(__err_msg__["pol.nf"] %(strongName))
+
+        _RpcSerializationPolicy.__policies__[strongName] = policy
+        return policy
+
 class _RpcRequestReader:
     " Reader of request "
 
@@ -419,50 +1986,113 @@ class _RpcRequestReader:
     # @param content request string
     # @return request object
     def readRequest(self, content):
+        try:
+            version, flags = self.__readHeader(content)
+            req = self.__readCall(version, flags)
+        except (ValueError, OverflowError), inst:
+            # token is not a number
+            raise _RpcException(__err_msg__["req.inv"] %(inst))
+        if req.error != None:
+            raise req.error
+        return req
+
+    ##
+    # read batch of requests sharing one header and string table:
+    # version, flags, string table, number of calls and then calls (from module base url
+    # to parameters values, as in single request)
+    # @param content request string
+    # @return list of request objects
+    def readBatch(self, content):
+        try:
+            version, flags = self.__readHeader(content)
+            requests = []
+            for i in xrange(self.__readInt()):
+                requests.append(self.__readCall(version, flags))
+            return requests
+        except (ValueError, OverflowError), inst:
+            raise _RpcException(__err_msg__["req.inv"] %(inst))
 
-        self.__tokenList = None
+    ##
+    # read protocol version, flags and string table
+    # @return tuple of (version, flags)
+    def __readHeader(self, content):
+        self.__tokens = None
         self.__stringTable = None
+        self.__prepareToRead(content)
+
+        version = self.__readInt()
+        if version < _RpcRequest.MIN_VERSION or version > _RpcRequest.MAX_VERSION:
+            raise _RpcException(__err_msg__["ver.ns"] %(version))
+        self.__version = version
+        flags = self.__readInt()
+
+        self.__deserializeStringTable()
+        return (version, flags)
+
+    ##
+    # read single call, from module base url to parameters values
+    # @return request object
+    def __readCall(self, version, flags):
         self.__seenArray = []
-        self.__tokenListIndex = 0;
+        self.__arrayContainer = Arrays.LIST
+        self.__typeSignatures = None
 
         gwtRpcRequest = _RpcRequest();
-        self.__prepareToRead(content)
-        
-        print content
-        print self.__tokenList;
-        
-        gwtRpcRequest.version = self.__readInt()
-        gwtRpcRequest.flags = self.__readInt()
+        gwtRpcRequest.version = version
+        gwtRpcRequest.flags = flags
 
-        self.__deserializeStringTable()
+        gwtRpcRequest.moduleBaseURL = self.__readString()
+        gwtRpcRequest.strongName = self.__readString()
 
-        if gwtRpcRequest.version > 2 :
-            gwtRpcRequest.moduleBaseURL = self.__readString()
-            gwtRpcRequest.strongName = self.__readString()
+        policy = None
+        if gwtRpcRequest.flags & _RpcRequest.FLAG_ELIDE_TYPE_NAMES:
+            policy = _RpcSerializationPolicy.forStrongName(gwtRpcRequest.strongName)
+            self.__typeSignatures = policy.typeSignatures
+        if gwtRpcRequest.flags & _RpcRequest.FLAG_RPC_TOKEN_INCLUDED:
+            gwtRpcRequest.rpcToken = self.__readObject()
 
         gwtRpcRequest.serviceIntfName = self.__readString()
+        if policy != None:
+            gwtRpcRequest.serviceIntfName = policy.className(gwtRpcRequest.serviceIntfName)
         gwtRpcRequest.serviceMethodName = self.__readString()
 
+        # unknown method fails only its call, parameters are still read so next call of
+        # batch can be read
+        try:
+            gwtRpcRequest.dispatch = _RpcMethod.forName(
+                gwtRpcRequest.serviceIntfName, gwtRpcRequest.serviceMethodName)
+            self.__arrayContainer = gwtRpcRequest.dispatch.arrays
+        except _RpcException, inst:
+            gwtRpcRequest.error = inst
+
         paramCount = self.__readInt()
         gwtRpcRequest.parameterTypes = []
 
-        for i in range(paramCount):
-            gwtRpcRequest.parameterTypes.append(self.__readString())
+        for i in xrange(paramCount):
+            if policy != None:
+                gwtRpcRequest.parameterTypes.append(policy.className(self.__readString()))
+            else:
+                gwtRpcRequest.parameterTypes.append(self.__readString())
 
         gwtRpcRequest.parameterValues = self.__readParametersValues(gwtRpcRequest.parameterTypes)
         return gwtRpcRequest
 
     def __prepareToRead(self, content):
-        content = content.decode(self.__content_type__)
-        self.__tokenList = content.split(self.__token_separator__)
-        RpcHandler.ctx.requestText = str(self.__tokenList)
+        if Limits.MAX_BODY_SIZE != None and len(content) > Limits.MAX_BODY_SIZE:
+            raise _RpcException(__err_msg__["req.lim"] %("MAX_BODY_SIZE", Limits.MAX_BODY_SIZE))
+        self.__tokens = _RpcTokenCursor(content, self.__token_separator__, self.__content_type__,
+            Limits.MAX_TOKENS)
+        self.__depth = 0
+        _RpcContext.current().requestText = content
 
 
     def __deserializeStringTable(self):
         count = self.__readInt()
+        if Limits.MAX_STRINGS != None and count > Limits.MAX_STRINGS:
+            raise _RpcException(__err_msg__["req.lim"] %("MAX_STRINGS", Limits.MAX_STRINGS))
         self.__stringTable = []
-        for i in range(count):
-            self.__stringTable.append(self.__extract())
+        for i in xrange(count):
+            self.__stringTable.append(self.__tokens.skip())
 
     def __readParametersValues(self, types):
         paramValues = []
@@ -471,27 +2101,13 @@ class _RpcRequestReader:
         return paramValues
 
     def __deserializeValue(self, type):
-        val = None
-        try:
-            val = {
-               Types.INT: self.__readInt,
-               Types.LONG: self.__readLong,
-               Types.SHORT: self.__readShort,
-               Types.FLOAT: self.__readFloat,
-               Types.DOUBLE: self.__readDouble,
-               Types.BOOLEAN: self.__readBoolean,
-               Types.CHAR: self.__readChar,
-               Types.BYTE: self.__readByte,
-               Types.STRING: self.__readString
-           }[type]()
-        except KeyError:
-            val =  self.__readObject()
-        return val
+        fun = self.__valueReaders__.get(type)
+        if fun == None:
+            return self.__readObject()
+        return fun(self)
 
     def __readInt(self):
-        v = self.__extract()
-        print v
-        return int(v)
+        return int(self.__extract())
 
     def __readBoolean(self):
         return int(self.__extract()) == 1
@@ -503,7 +2119,12 @@ class _RpcRequestReader:
         return float(self.__extract())
 
     def __readLong(self):
-        return eval("0X"+self.__extract()+"L")
+        if self.__version < 5:
+            return int(self.__extract(), 16)
+        if self.__version == 5:
+            # long is sent as a pair of doubles
+            return long(self.__readDouble()) + long(self.__readDouble())
+        return _RpcUtils.long_from_base64(self.__extract())
 
     def __readShort(self):
         return int(self.__extract())
@@ -521,22 +2142,35 @@ class _RpcRequestReader:
     def __getString(self, index):
         if index == 0:
             return None
-        return self.__stringTable[index - 1]
+        if index < 0 or index > len(self.__stringTable):
+            raise _RpcException(__err_msg__["req.inv"] %("string index %s" %(index)))
+        s = self.__stringTable[index - 1]
+        if isinstance(s, tuple):
+            # string is decoded on first use
+            s = self.__tokens.decode(s)
+            self.__stringTable[index - 1] = s
+        return s
 
     def __extract(self):
-        var = self.__tokenList[self.__tokenListIndex]
-        self.__tokenListIndex += 1
-        return var
+        return self.__tokens.next()
 
     def __readObject(self):
 
         token = self.__readInt()
         if token < 0:
-            return self.__seenArray[(-(token + 1))]
+            # back reference to decoded object, in order of registration
+            try:
+                return self.__seenArray[-(token + 1)]
+            except IndexError:
+                raise _RpcException(__err_msg__["ref.nf"] %(token))
 
         typeSignature = self.__getString(token)
         if typeSignature == None:
             return None
+        if self.__typeSignatures != None:
+            if typeSignature not in self.__typeSignatures:
+                raise _RpcException(__err_msg__["pol.tnf"] %(typeSignature))
+            typeSignature = self.__typeSignatures[typeSignature]
         return self.__deserialize(typeSignature)
 
     def __deserialize(self, typeSignature):
@@ -551,45 +2185,127 @@ class _RpcRequestReader:
         if sig.__signatures__[name] != signature:
             raise _RpcException(__err_msg__["sig.ne"] %(name))
 
+        self.__depth += 1
+        if Limits.MAX_DEPTH != None and self.__depth > Limits.MAX_DEPTH:
+            raise _RpcException(__err_msg__["req.lim"] %("MAX_DEPTH", Limits.MAX_DEPTH))
+
+        # object is registered before its content is read (as in GWT), so nested and
+        # cyclic references resolve to the same instance
+        index = len(self.__seenArray)
+        self.__seenArray.append(None)
         if name.startswith("["):
-            return self.__deserializeArray(name)
+            res = self.__deserializeArray(name, index)
         else:
-            return self.__deserializeObject(name)
+            res = self.__deserializeObject(name, index)
+        self.__depth -= 1
+        return res
 
-    def __deserializeArray(self, name):
-        res = []
-        len = self.__readInt()
-        fun = None
-        try:
-            fun = {
-                Types.getArrayType(Types.INT): self.__readInt,
-                Types.getArrayType(Types.LONG): self.__readLong,
-                Types.getArrayType(Types.SHORT): self.__readShort,
-                Types.getArrayType(Types.FLOAT): self.__readFloat,
-                Types.getArrayType(Types.DOUBLE): self.__readDouble,
-                Types.getArrayType(Types.BOOLEAN): self.__readBoolean,
-                Types.getArrayType(Types.CHAR): self.__readChar,
-                Types.getArrayType(Types.BYTE): self.__readByte,
-                Types.getArrayType(Types.STRING): self.__readString
-           }[name]
-        except KeyError:
-            fun =  self.__readObject
-        for i in range(len):
-            res.append(fun())
-        self.__seenArray.append(res)
+    def __deserializeArray(self, name, index):
+        count = self.__readInt()
+        if Limits.MAX_ARRAY_LENGTH != None and count > Limits.MAX_ARRAY_LENGTH:
+            raise _RpcException(__err_msg__["req.lim"] %("MAX_ARRAY_LENGTH", Limits.MAX_ARRAY_LENGTH))
+        if self.__arrayContainer != Arrays.LIST and name in self.__bulkTypes__ and \
+                (name != Types.getArrayType(Types.LONG) or self.__version != 5):
+            # primitives only, no references inside
+            res = self.__readBulk(name, count)
+            self.__seenArray[index] = res
+        else:
+            res = []
+            self.__seenArray[index] = res
+            fun = self.__valueReaders__.get(Types.getTypeFromArrayType(name))
+            if fun == None:
+                for i in xrange(count):
+                    res.append(self.__readObject())
+            else:
+                for i in xrange(count):
+                    res.append(fun(self))
         return res
 
-    def __deserializeObject(self, name):
+    ##
+    # read whole primitive array in one step
+    # @param name array type name
+    # @param count number of elements
+    # @return array.array or numpy.ndarray object
+    def __readBulk(self, name, count):
+        parse, code, dtype = self.__bulkTypes__[name]
+        tokens = self.__tokens.nextMany(count, self.__bulkTokenLen__)
+        if self.__arrayContainer == Arrays.NUMPY and parse != None:
+            # numpy parses decimal tokens itself, without python object per element
+            return numpy.array(tokens, dtype)
+        if parse == None:
+            parse = self.__version < 5 and (lambda t: int(t, 16)) or _RpcUtils.long_from_base64
+        values = map(parse, tokens)
+        if self.__arrayContainer == Arrays.NUMPY:
+            return numpy.array(values, dtype)
+        return array.array(code, values)
+
+    def __deserializeObject(self, name, index):
+        decoder = self.__decoders__.get(name)
+        if decoder == None:
+            decoder = _RpcRequestReader.compileDecoder(name)
+        return decoder(self, self.__seenArray, index)
+
+    ##
+    # build specialized decode function for VO class, the function reads all
+    # serialized fields in straight line without type dispatch
+    # @param name class name
+    # @return decode function, called with reader instance, table of decoded
+    # objects and index of instance in the table
+    @staticmethod
+    def compileDecoder(name):
         classe = _RpcUtils.class_for_name(name)
-        instance = new.instance(classe)
+        serialization, fields = _RpcUtils.serialization_plan(classe)
+
+        namespace = {"new": new, "classe": classe}
+        code = ["def decode(reader, seen, index):",
+                "    instance = new.instance(classe)",
+                "    seen[index] = instance",
+                "    d = instance.__dict__"]
+        for i in range(len(fields)):
+            fun = _RpcRequestReader.__valueReaders__.get(serialization[fields[i]])
+            if fun == None:
+                fun = _RpcRequestReader.__readObject.im_func
+            namespace["read%d" % i] = fun
+            code.append("    d[%r] = read%d(reader)" % (fields[i], i))
+        code.append("    return instance")
+
+        exec "\n".join(code) in namespace
+        decoder = namespace["decode"]
+        _RpcRequestReader.__decoders__[name] = decoder
+        return decoder
 
-        serialization = dict()
-        fields = []
-        _RpcUtils.multi_inherit_serialization(classe, serialization, fields)
-        for fname in fields:
-            val = self.__deserializeValue(serialization[fname])
-            instance.__dict__[fname] = val
-        return instance
+    ##
+    # primitive arrays read in one step, array type name as key and tuple of
+    # (token parser, array.array type code, numpy dtype) as value, long parser
+    # depends on protocol version (long arrays of version 5 are read per element)
+    __bulkTypes__ = {
+        Types.getArrayType(Types.INT): (int, 'i', 'int32'),
+        Types.getArrayType(Types.LONG): (None, 'l', 'int64'),
+        Types.getArrayType(Types.FLOAT): (float, 'f', 'float32'),
+        Types.getArrayType(Types.DOUBLE): (float, 'd', 'float64')
+    }
+
+    ##
+    # expected maximal length of primitive token, used for cutting bulk token run
+    __bulkTokenLen__ = 24
+
+    ##
+    # cache of compiled decode functions, class name as key
+    __decoders__ = dict()
+
+    ##
+    # readers of primitives and strings, type name as key
+    __valueReaders__ = {
+       Types.INT: __readInt,
+       Types.LONG: __readLong,
+       Types.SHORT: __readShort,
+       Types.FLOAT: __readFloat,
+       Types.DOUBLE: __readDouble,
+       Types.BOOLEAN: __readBoolean,
+       Types.CHAR: __readChar,
+       Types.BYTE: __readByte,
+       Types.STRING: __readString
+    }
 
 class _RpcResponseWriter:
     " Response writer "
@@ -602,13 +2318,20 @@ class _RpcResponseWriter:
     # @return response string
     def encodeResponse(self, o, req, ex = False):
         self.__objectCount = 0
+        # index of written object, id of object as key
         self.__objMap = dict()
         self.__tokenList = []
         self.__tokenListCharCount = 0
         self.__stringMap = dict()
         self.__stringTable = []
-        self.__request = None
+        if req == None:
+            # request was not decoded (e.g. unsupported version), answer with default header
+            req = _RpcRequest()
+            req.version = _RpcRequest.MAX_VERSION
         self.__request = req
+        self.__typeIds = None
+        if req != None and req.flags & _RpcRequest.FLAG_ELIDE_TYPE_NAMES:
+            self.__typeIds = _RpcSerializationPolicy.forStrongName(req.strongName).typeIds
 
         if not ex:
             if self.__request.returnType != Types.VOID:
@@ -622,20 +2345,11 @@ class _RpcResponseWriter:
 
 
     def __serializeValue(self, o, t):
-        try:
-            {
-               Types.INT: self.__writeAsString,
-               Types.LONG: self.__writeAsString,
-               Types.SHORT: self.__writeAsString,
-               Types.FLOAT: self.__writeAsString,
-               Types.DOUBLE: self.__writeAsString,
-               Types.BOOLEAN: self.__writeBoolean,
-               Types.CHAR: self.__writeAsString,
-               Types.BYTE: self.__writeAsString,
-               Types.STRING: self.__writeString
-            }[t](o)
-        except KeyError:
+        fun = self.__valueWriters__.get(t)
+        if fun == None:
             self.__writeObject(o, t)
+        else:
+            fun(self, o)
 
     def __serializeException(self, ex):
         return
@@ -651,47 +2365,61 @@ class _RpcResponseWriter:
             self.__stringMap[string] = i
             return i
 
+    # parts are joined once, so building of response is linear
     def __toString(self):
-        buffer = ""
-        buffer += "[";
-        buffer = self.__writePayload(buffer)
-        buffer = self.__writeStringTable(buffer)
-        buffer = self.__writeHeader(buffer)
-        buffer += "]"
-        return buffer
-
-    def __writePayload(self, b):
-
-        for i in range(len(self.__tokenList)):
-            k = len(self.__tokenList) - i  -1
-
-            token = self.__tokenList[k]
-            b += token
-            if k > 0:
-                b += ","
-        return b
-
-    def __writeStringTable(self, buffer):
+        parts = ["["]
+        self.__writePayload(parts)
+        self.__writeStringTable(parts)
+        self.__writeHeader(parts)
+        parts.append("]")
+        return "".join(parts)
+
+    def __writePayload(self, parts):
         if len(self.__tokenList) > 0:
-            buffer += ","
-        buffer += "["
-        for i in range(len(self.__stringTable)):
-            if i > 0:
-                buffer += ","
-            buffer += self.__escapeString(self.__stringTable[i])
-        buffer += "]"
-        return buffer
-
-    def __writeHeader(self, buffer):
-        buffer += ","
-        buffer += str(self.__request.flags)
-        buffer += ","
-        buffer += str(self.__request.version)
-        return buffer
-
-    def __escapeString(self, str):
-        # TODO implement
-        return '"' + str + '"'
+            # tokens are written in reverse order
+            self.__tokenList.reverse()
+            parts.append(",".join(self.__tokenList))
+            parts.append(",")
+
+    def __writeStringTable(self, parts):
+        parts.append("[")
+        parts.append(",".join(map(self.__escapeString, self.__stringTable)))
+        parts.append("]")
+
+    def __writeHeader(self, parts):
+        parts.append(",%d,%d" %(self.__request.flags, self.__request.version))
+
+    ##
+    # @param s string from string table
+    # @return quoted UTF-8 str, with escaped quotes, backslashes, control characters and
+    #         line/paragraph separators
+    def __escapeString(self, s):
+        # line/paragraph separators of UTF-8 str are searched in decoded text,
+        # ASCII str is escaped as is
+        if isinstance(s, str) and self.__nonAsciiPattern__.search(s) != None:
+            s = s.decode("utf-8", "replace")
+        escaped = self.__escapedCache__.get(s)
+        if escaped != None:
+            return escaped
+        if self.__escapePattern__.search(s) == None:
+            escaped = '"' + s + '"'
+        else:
+            escaped = '"' + self.__escapePattern__.sub(_RpcResponseWriter.__escapeChar, s) + '"'
+        # keeps response str, so it is not widened to unicode by a single string
+        if isinstance(escaped, unicode):
+            escaped = escaped.encode("utf-8")
+
+        # short strings (type signatures, enumerated values) are often repeated
+        if len(s) <= self.ESCAPE_CACHE_STRING_LEN:
+            cache = self.__escapedCache__
+            if len(cache) >= self.ESCAPE_CACHE_SIZE:
+                _RpcResponseWriter.__escapedCache__ = cache = dict()
+            cache[s] = escaped
+        return escaped
+
+    @staticmethod
+    def __escapeChar(match):
+        return _RpcResponseWriter.__escapes__[match.group()]
 
     def __writeBoolean(self, b):
         val = {
@@ -703,77 +2431,188 @@ class _RpcResponseWriter:
     def __writeString(self, value):
         self.__writeAsString(self.__addString(value));
 
+    def __writeLong(self, value):
+        if self.__request.version == 5:
+            # long is sent as a pair of doubles, low and high part
+            self.__append(repr(float(value & 0xFFFFFFFF)))
+            self.__append(repr(float((value >> 32) << 32)))
+        else:
+            self.__append(self.__formatLong(value))
+
+    ##
+    # @return long token for protocol versions other than 5
+    def __formatLong(self, value):
+        if self.__request.version < 5:
+            return str(value)
+        return "'" + _RpcUtils.long_to_base64(value) + "'"
+
     def __writeAsString(self, o):
         self.__append(str(o))
 
 
     def __writeObject(self, o, t = ""):
-        if o == None:
+        # identity test, numpy arrays compare element-wise
+        if o is None:
             self.__writeString("null");
         else:
-            if not isinstance(o, list):
-                if o in self.__objMap:
-                    pos = self.__objMap[o]
-                    self.__writeAsString(-(pos + 1))
-                else:
-                    self.__objMap[o] = self.__objectCount
-                    self.__objectCount +=1
+            plan = self.__plans__.get(t)
+            if plan == None or self.__plansSignatures__ is not sig.__signatures__:
+                plan = _RpcResponseWriter.compilePlan(t)
+
+            # objects and arrays are registered by identity, written instance is
+            # referenced by the response graph, so its id is not reused while encoding
+            pos = self.__objMap.get(id(o))
+            if pos != None:
+                self.__writeAsString(-(pos + 1))
+                return
+            self.__objMap[id(o)] = self.__objectCount
+            self.__objectCount +=1
+
+            if self.__typeIds == None:
+                self.__writeString(plan[0]);
             else:
-                self.__objectCount +=1
+                if plan[0] not in self.__typeIds:
+                    raise _RpcException(__err_msg__["pol.tnf"] %(plan[0]))
+                self.__writeString(self.__typeIds[plan[0]]);
 
-            s = t
-            s += "/"
-
-            if sig.__signatures__ == None:
-                raise _RpcException(__err_msg__["sig.nf"])
-            if t not in sig.__signatures__:
-                raise _RpcException(__err_msg__["sig.tnf"] %(t))
-
-            s += sig.__signatures__[t]
-            self.__writeString(s);
-
-            if t.startswith("["):
-                self.__serializeArray(o, t)
+            if plan[1] == None:
+                self.__serializeArray(o, plan)
             else:
-                self.__serialize(o, t)
+                self.__serialize(o, plan)
 
-    def __serialize(self, o, t):
-        classe = _RpcUtils.class_for_name(t)
-        serialization = dict()
-        fields = []
-        _RpcUtils.multi_inherit_serialization(classe, serialization, fields)
-        for fname in fields:
-            self.__serializeValue(o.__dict__[fname], serialization[fname])
+    def __serialize(self, o, plan):
+        d = o.__dict__
+        for fname, ftype, fun in plan[1]:
+            if fun == None:
+                self.__writeObject(d[fname], ftype)
+            else:
+                fun(self, d[fname])
 
-    def __serializeArray(self, o, t):
+    def __serializeArray(self, o, plan):
         self.__writeAsString(len(o))
-        try:
-            fun = {
-                Types.getArrayType(Types.INT): self.__writeAsString,
-                Types.getArrayType(Types.LONG): self.__writeAsString,
-                Types.getArrayType(Types.SHORT): self.__writeAsString,
-                Types.getArrayType(Types.FLOAT): self.__writeAsString,
-                Types.getArrayType(Types.DOUBLE): self.__writeAsString,
-                Types.getArrayType(Types.BOOLEAN): self.__writeBoolean,
-                Types.getArrayType(Types.CHAR): self.__writeAsString,
-                Types.getArrayType(Types.BYTE): self.__writeAsString,
-                Types.getArrayType(Types.STRING): self.__writeString
-            }[t]
+        if plan[4] and (plan[2] != Types.LONG or self.__request.version != 5):
+            self.__writeBulk(o, plan[2])
+            return
+        fun = plan[3]
+        if fun == None:
+            et = plan[2]
             for a in o:
-                fun(a)
-        except KeyError:
+                self.__writeObject(a, et)
+        else:
             for a in o:
-                self.__writeObject(a, Types.getTypeFromArrayType(t))
+                fun(self, a)
+
+    ##
+    # write whole primitive array as one token block
+    # @param o list, array.array or numpy.ndarray object
+    # @param et array element type
+    def __writeBulk(self, o, et):
+        if len(o) == 0:
+            return
+        if numpy != None and isinstance(o, numpy.ndarray):
+            o = o.tolist()
+        format = str
+        if et == Types.LONG:
+            format = self.__formatLong
+        # tokens are written to payload in reverse order
+        self.__append(",".join(map(format, reversed(o))))
 
     def __append(self, token):
         self.__tokenList.append(token);
         if token != None:
             self.__tokenListCharCount += len(token)
 
+    ##
+    # build encoding plan for declared type
+    # @param t declared type name (VO class or array type)
+    # @return tuple of (type signature string, fields tuple of (name, type, writer),
+    #         array element type, array element writer, is array written as one block)
+    @staticmethod
+    def compilePlan(t):
+        signatures = sig.__signatures__
+        if signatures == None:
+            raise _RpcException(__err_msg__["sig.nf"])
+        if t not in signatures:
+            raise _RpcException(__err_msg__["sig.tnf"] %(t))
+        if _RpcResponseWriter.__plansSignatures__ is not signatures:
+            _RpcResponseWriter.invalidatePlans()
+
+        if t.startswith("["):
+            et = Types.getTypeFromArrayType(t)
+            plan = (t + "/" + signatures[t], None, et, _RpcResponseWriter.__valueWriters__.get(et),
+                    et in _RpcResponseWriter.__bulkTypes__)
+        else:
+            classe = _RpcUtils.class_for_name(t)
+            serialization, fields = _RpcUtils.serialization_plan(classe)
+            accessors = []
+            for fname in fields:
+                ftype = serialization[fname]
+                accessors.append((fname, ftype, _RpcResponseWriter.__valueWriters__.get(ftype)))
+            plan = (t + "/" + signatures[t], tuple(accessors), None, None, False)
+
+        _RpcResponseWriter.__plans__[t] = plan
+        _RpcResponseWriter.__plansSignatures__ = signatures
+        return plan
+
+    ##
+    # drop all encoding plans, call it after in place modification of pgr.sig.__signatures__
+    # (plans are dropped automatically when pgr.sig.__signatures__ is replaced)
+    @staticmethod
+    def invalidatePlans():
+        _RpcResponseWriter.__plans__ = dict()
+        _RpcResponseWriter.__plansSignatures__ = None
+
+    ##
+    # cache of encoding plans, declared type name as key
+    __plans__ = dict()
+
+    ##
+    # characters escaped in strings and their escape sequences
+    __escapePattern__ = re.compile(u'[\x00-\x1f"\\\\\x7f\u2028\u2029]')
+    __escapes__ = dict((unichr(c), u"\\u%04x" %(c)) for c in range(0x20) + [0x7f, 0x2028, 0x2029])
+    __escapes__.update({u'"': u'\\"', u"\\": u"\\\\", u"\n": u"\\n", u"\r": u"\\r",
+                        u"\t": u"\\t", u"\b": u"\\b", u"\f": u"\\f"})
+    # bytes of str decoded before escaping
+    __nonAsciiPattern__ = re.compile('[\x80-\xff]')
+
+    ##
+    # cache of escaped strings, limits of cached strings number and length
+    __escapedCache__ = dict()
+    ESCAPE_CACHE_SIZE = 10000
+    ESCAPE_CACHE_STRING_LEN = 256
+
+    ##
+    # signatures dictionary used for building cached plans
+    __plansSignatures__ = None
+
+    ##
+    # element types of primitive arrays written as one token block
+    __bulkTypes__ = (Types.INT, Types.LONG, Types.SHORT, Types.FLOAT, Types.DOUBLE, Types.BYTE)
+
+    ##
+    # writers of primitives and strings, type name as key
+    __valueWriters__ = {
+       Types.INT: __writeAsString,
+       Types.LONG: __writeLong,
+       Types.SHORT: __writeAsString,
+       Types.FLOAT: __writeAsString,
+       Types.DOUBLE: __writeAsString,
+       Types.BOOLEAN: __writeBoolean,
+       Types.CHAR: __writeAsString,
+       Types.BYTE: __writeAsString,
+       Types.STRING: __writeString
+    }
+
 class _RpcUtils:
     " Reflection utility class "
 
     __class_cache__ = dict()
+    __class_lock__ = threading.RLock()
+    ##
+    # messages of failed class loads, class name as key, and limit of their number
+    __class_errors__ = dict()
+    CLASS_ERRORS_SIZE = 1000
+    __serialization_cache__ = dict()
 
     ##
     # read serialization information from base class and its children
@@ -791,32 +2630,154 @@ class _RpcUtils:
         for b in classe.__bases__:
             _RpcUtils.multi_inherit_serialization(b, dict, fields)
 
+    ##
+    # convert value to hashable form, lists and arrays to tuples, objects to tuple of class and fields
+    # @param o value
+    # @return hashable value (if value contains only hashable items), None if value is cyclic
+    @staticmethod
+    def freeze(o):
+        try:
+            return _RpcUtils.__freeze(o, set())
+        except _RpcCyclicValue:
+            return None
+
+    # @param path ids of lists and objects containing value
+    @staticmethod
+    def __freeze(o, path):
+        if isinstance(o, (list, tuple, array.array)):
+            items = o
+        elif numpy != None and isinstance(o, numpy.ndarray):
+            return tuple(o.tolist())
+        elif hasattr(o, "__dict__"):
+            items = o.__dict__.items()
+            items.sort()
+        else:
+            return o
+
+        if id(o) in path:
+            raise _RpcCyclicValue()
+        path.add(id(o))
+        if isinstance(o, (list, tuple, array.array)):
+            frozen = tuple([_RpcUtils.__freeze(i, path) for i in items])
+        else:
+            frozen = (o.__class__, tuple([(k, _RpcUtils.__freeze(v, path)) for k, v in items]))
+        path.remove(id(o))
+        return frozen
+
+    ##
+    # cached version of multi_inherit_serialization
+    # @param classe class to be checked
+    # @return tuple of (dict with field/method name as key and type as value, list of fields names)
+    @staticmethod
+    def serialization_plan(classe):
+        plan = _RpcUtils.__serialization_cache__.get(classe)
+        if plan == None:
+            serialization = dict()
+            fields = []
+            _RpcUtils.multi_inherit_serialization(classe, serialization, fields)
+            plan = (serialization, fields)
+            _RpcUtils.__serialization_cache__[classe] = plan
+        return plan
+
+    __base64_chars__ = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789$_"
+    __base64_values__ = dict((c, i) for i, c in enumerate(__base64_chars__))
+
+    ##
+    # decode long from GWT base64 form (used by protocol version 6 and above)
+    # @param s encoded value
+    # @return long value
+    @staticmethod
+    def long_from_base64(s):
+        value = 0
+        try:
+            for c in s:
+                value = (value << 6) | _RpcUtils.__base64_values__[c]
+        except KeyError:
+            raise ValueError("invalid long token '%s'" %(s))
+        if value >= 1 << 63:
+            value -= 1 << 64
+        return value
+
+    ##
+    # encode long to GWT base64 form (used by protocol version 6 and above)
+    # @param value long value
+    # @return encoded value
+    @staticmethod
+    def long_to_base64(value):
+        value = value & 0xFFFFFFFFFFFFFFFF
+        chars = []
+        while True:
+            chars.append(_RpcUtils.__base64_chars__[value & 0x3F])
+            value >>= 6
+            if value == 0:
+                break
+        chars.reverse()
+        return "".join(chars)
+
     ##
     # return class object for give name
     # @param class name (with package/module)
     # @return class object
     @staticmethod
     def class_for_name(name):
-        if name in _RpcUtils.__class_cache__:
-            return _RpcUtils.__class_cache__[name]
-
-        className = None
+        # lookup of loaded class is not locked
+        classe = _RpcUtils.__class_cache__.get(name)
+        if classe != None:
+            return classe
+        if not _RpcUtils.__is_allowed(name):
+            raise _RpcException(__err_msg__["cna"] %(name))
+        error = _RpcUtils.__class_errors__.get(name)
+        if error != None:
+            raise _RpcException(error)
+
+        # first load is serialized, so module is imported only once
+        _RpcUtils.__class_lock__.acquire()
+        try:
+            classe = _RpcUtils.__class_cache__.get(name)
+            if classe == None:
+                try:
+                    classe = _RpcUtils.__load_class(name)
+                except _RpcException, inst:
+                    errors = _RpcUtils.__class_errors__
+                    if len(errors) >= _RpcUtils.CLASS_ERRORS_SIZE:
+                        _RpcUtils.__class_errors__ = errors = dict()
+                    errors[name] = str(inst)
+                    raise
+                _RpcUtils.__class_cache__[name] = classe
+            return classe
+        finally:
+            _RpcUtils.__class_lock__.release()
 
+    @staticmethod
+    def __load_class(name):
         pos = name.rfind(".")
         if pos > -1:
             parts = name.rpartition(".")
             module = _RpcUtils.import_module(parts[0])
             className = parts[2]
-
+            namespace = module.__dict__
         else:
             className = name
-            module = globals()
-        if className not in module.__dict__:
+            namespace = globals()
+        if className not in namespace:
             raise _RpcException(__err_msg__["cnf"] %(name))
+        return namespace[className]
 
-        classe = getattr(module, className)
-        _RpcUtils.__class_cache__[name] = classe
-        return classe
+    ##
+    # @param name class name
+    # @return True if class module can be imported, see RpcHandler.ALLOWED_PACKAGES
+    @staticmethod
+    def __is_allowed(name):
+        packages = RpcHandler.ALLOWED_PACKAGES
+        if packages == None:
+            return True
+        if name in RpcHandler.registeredServices() or \
+                (sig.__signatures__ != None and name in sig.__signatures__):
+            return True
+        for package in packages:
+            if name.startswith(package + "."):
+                return True
+        return False
 
     ##
     # import module by name
@@ -826,8 +2787,10 @@ class _RpcUtils:
         try:
             mod = __import__(name)
         except Exception, inst:
-            # Found some error in service source
-            logging.exception(inst)
+            # Found some error in service source, traceback only in debug log,
+            # because names of missing modules can come from request
+            logging.error("Can't import module '%s': %s", name, inst)
+            logging.debug("Import of module '%s' failed", name, exc_info = True)
             raise _RpcException(__err_msg__["pnf"] %(name))
         components = name.split('.')
         for comp in components[1:]:
@@ -835,3 +2798,17 @@ class _RpcUtils:
         return mod
 
 
+##
+# call service method in worker process of process pool, module level function to be picklable
+# @param serviceIntfName service interface name
+# @param serviceMethodName service method name
+# @param parameterValues parameters values
+# @return service method return value
+def _evaluateInProcess(serviceIntfName, serviceMethodName, parameterValues):
+    dispatch = _RpcMethod.forName(serviceIntfName, serviceMethodName)
+    instance = _RpcInstances.get(dispatch.classe, dispatch.scope)
+    try:
+        return dispatch.function(instance, *parameterValues)
+    finally:
+        if dispatch.scope == Scopes.REQUEST:
+            _RpcInstances.release(instance)
@@ -6,6 +6,28 @@ r"""
 
 PGR LOGGING - Example interceptor for PGR library
 
+    - Description -
+
+        LoggingInterceptor logs every interceptor call, it is useful for debugging.
+        RequestLogInterceptor writes one record per request with method, timings,
+        sizes, user and outcome, for production use.
+
+    - How to use -
+
+        1. Attach asynchronous handler to "pgr.requests" logger, records are passed to
+           target handler by background thread:
+
+            handler = log.QueueHandler(logging.StreamHandler())
+            logging.getLogger(log.RequestLogInterceptor.LOGGER).addHandler(handler)
+
+        2. Add interceptor with sampling rates (0 - 1) of methods, name of method is
+           "service interface name.method name":
+
+            core.RpcHandler.addInterceptr(log.RequestLogInterceptor(
+                rates = {"pkg.services.SearchService.search" : 0.01}, defaultRate = 0.1))
+
+           Failed requests are always logged. Record message is a list of key=value pairs,
+           fields are also available as "rpc" attribute of log record.
 
     - History -
 
@@ -36,7 +58,11 @@ __credits__ =   """
 
 """
 
+import time
+import Queue
+import random
 import logging
+import threading
 
 from pgr.core import RpcHandler
 
@@ -103,4 +129,107 @@ class LoggingInterceptor:
 
     def afterUserAuthentication(self):
         logging.info("afterUserAuthentication")
-        pass
\ No newline at end of file
+        pass
+
+
+class _Fields(dict):
+    " Fields of request record, formatted to key=value pairs when record is written "
+
+    def __str__(self):
+        return " ".join(["%s=%s" %(k, self[k]) for k in sorted(self)])
+
+
+class RequestLogInterceptor:
+    " Interceptor writing one sampled record per request "
+
+    LOGGER = "pgr.requests"
+
+    ##
+    # @param rates sampling rates (0 - 1) of methods, "service.method" name as key
+    # @param defaultRate sampling rate of other methods
+    # @param logger logger, "pgr.requests" logger by default
+    def __init__(self, rates = None, defaultRate = 1.0, logger = None):
+        self.rates = rates or dict()
+        self.defaultRate = defaultRate
+        self.logger = logger or logging.getLogger(self.LOGGER)
+
+    def beforeRequestDecode(self):
+        RpcHandler.ctx.logStart = time.time()
+
+    def afterResponseDecode(self):
+        ctx = RpcHandler.ctx
+        req = ctx.requestObject
+        method = "%s.%s" %(req.serviceIntfName, req.serviceMethodName)
+        if random.random() >= self.rates.get(method, self.defaultRate):
+            return
+
+        outcome = "ok"
+        if req.cachedResponse != None:
+            outcome = "cached"
+        self.__log(logging.INFO, ctx, req, method, outcome)
+
+    def afterExceptionDecode(self):
+        ctx = RpcHandler.ctx
+        req = ctx.requestObject
+        method = None
+        if req != None:
+            method = "%s.%s" %(req.serviceIntfName, req.serviceMethodName)
+        self.__log(logging.WARNING, ctx, req, method, "error")
+
+    def __log(self, level, ctx, req, method, outcome):
+        fields = _Fields()
+        fields["method"] = method
+        fields["outcome"] = outcome
+        fields["total"] = "%.2f" %((time.time() - getattr(ctx, "logStart", time.time())) * 1000)
+        if req != None:
+            fields["decode"] = "%.2f" %(req.decodeTime * 1000)
+            fields["evaluate"] = "%.2f" %(req.evaluateTime * 1000)
+            fields["encode"] = "%.2f" %(req.encodeTime * 1000)
+            fields["requestSize"] = req.requestSize
+        if ctx.responseText != None:
+            fields["responseSize"] = len(ctx.responseText)
+        if ctx.user != None:
+            fields["role"] = ctx.user.roles
+        if outcome == "error":
+            fields["error"] = repr(str(ctx.exception))
+        self.logger.log(level, "rpc %s", fields, extra = {"rpc": fields})
+
+
+class QueueHandler(logging.Handler):
+    " Handler passing records to target handler on background thread, records are dropped when queue is full "
+
+    ##
+    # @param target handler writing records
+    # @param size maximal number of waiting records
+    def __init__(self, target, size = 10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.dropped = 0
+        self.__queue = Queue.Queue(size)
+        self.__thread = threading.Thread(target = self.__run, name = "pgr-log")
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def emit(self, record):
+        try:
+            self.__queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    ##
+    # write waiting records and stop background thread
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
+    def __run(self):
+        while True:
+            record = self.__queue.get()
+            if record == None:
+                break
+            try:
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
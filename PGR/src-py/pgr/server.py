@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+
+r"""
+
+PGR SERVER - Standalone WSGI application and pre-fork server for PGR library
+
+    - Description -
+
+        Runs PGR handlers without Google App Engine. RpcApplication is a plain WSGI
+        application, it can be served by any WSGI server. PreforkServer is a simple
+        server for Linux, it imports and prepares all services in parent process and
+        then forks workers, so all processors of machine are used.
+
+    - How to use -
+
+        1. Create application, the same way as webapp.WSGIApplication:
+
+            from pgr import core
+            from pgr import server
+
+            application = server.RpcApplication(
+                [('/services', core.RpcHandler), ('/services/batch', core.RpcBatchHandler)])
+
+        2. Run it in pre-fork server, with list of services interfaces to prepare
+           before forking:
+
+            server.PreforkServer(application, port = 8080, workers = 4,
+                services = ["pl.simpatico.pgrexample.client.services.ExampleService"]).run()
+
+           Default number of workers is number of processors.
+
+        ! pgr.auth module requires GAE memcache and can't be used without GAE.
+
+"""
+
+__author__ =    "Pawel Majewski <http://simpatico.pl/>"
+__version__ =   "0.1"
+__credits__ =   """
+
+    Copyright (c) 2008 Pawel Majewski  <http://simpatico.pl/>
+    Licensed under GNU GPL 3.0 or later. See license.txt included with this software.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import re
+import errno
+import signal
+import logging
+import Cookie
+import BaseHTTPServer
+from wsgiref import simple_server
+
+from pgr import core
+
+
+class _Request:
+    " Request passed to handler, subset of webapp.Request used by PGR "
+
+    def __init__(self, environ):
+        self.environ = environ
+        self.remote_addr = environ.get("REMOTE_ADDR")
+
+        length = environ.get("CONTENT_LENGTH")
+        if length:
+            self.body = environ["wsgi.input"].read(int(length))
+        else:
+            self.body = ""
+
+        self.cookies = dict()
+        if "HTTP_COOKIE" in environ:
+            cookie = Cookie.SimpleCookie()
+            cookie.load(environ["HTTP_COOKIE"])
+            for name in cookie:
+                self.cookies[name] = cookie[name].value
+
+
+class _Headers:
+    " Response headers "
+
+    def __init__(self):
+        self.items = [("Content-Type", "application/json; charset=utf-8")]
+
+    def add_header(self, name, value):
+        self.items.append((name, value))
+
+
+class _Output:
+    " Response body, list of written UTF-8 strings "
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        self.chunks.append(s)
+
+
+class _Response:
+    " Response passed to handler, subset of webapp.Response used by PGR "
+
+    def __init__(self):
+        self.status = "200 OK"
+        self.headers = _Headers()
+        self.out = _Output()
+
+    def set_status(self, code):
+        self.status = "%s %s" %(code, BaseHTTPServer.BaseHTTPRequestHandler.responses[code][0])
+
+
+class RpcApplication:
+    " WSGI application for PGR handlers, without GAE dependency "
+
+    ##
+    # size of response body pieces passed to WSGI server
+    CHUNK_SIZE = 64 * 1024
+
+    ##
+    # @param mapping list of tuples (url regular expression, handler class)
+    def __init__(self, mapping):
+        self.__mapping = []
+        for pattern, handler in mapping:
+            self.__mapping.append((re.compile("^" + pattern + "$"), handler))
+
+    def __call__(self, environ, start_response):
+        handlerClass = None
+        for pattern, handler in self.__mapping:
+            if pattern.match(environ.get("PATH_INFO", "")):
+                handlerClass = handler
+                break
+
+        if handlerClass == None:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return ["Not Found"]
+
+        handler = handlerClass()
+        method = getattr(handler, environ["REQUEST_METHOD"].lower(), None)
+        if method == None:
+            start_response("405 Method Not Allowed", [("Content-Type", "text/plain")])
+            return ["Method Not Allowed"]
+
+        # oversized body is not read at all
+        length = environ.get("CONTENT_LENGTH")
+        if length and core.Limits.MAX_BODY_SIZE != None and int(length) > core.Limits.MAX_BODY_SIZE:
+            start_response("413 Request Entity Too Large", [("Content-Type", "text/plain")])
+            return ["Request Entity Too Large"]
+
+        handler.request = _Request(environ)
+        handler.response = _Response()
+        method()
+
+        body = handler.response.out.chunks
+        headers = handler.response.headers.items + [("Content-Length", str(sum(map(len, body))))]
+        start_response(handler.response.status, headers)
+        return RpcApplication.__slices(body, self.CHUNK_SIZE)
+
+    ##
+    # @param chunks written strings
+    # @param size maximum size of slice
+    # @return iterator of slices of written strings, only one slice is copied at a time
+    @staticmethod
+    def __slices(chunks, size):
+        for chunk in chunks:
+            if len(chunk) <= size:
+                yield chunk
+                continue
+            for start in xrange(0, len(chunk), size):
+                yield chunk[start:start + size]
+
+
+class _QuietRequestHandler(simple_server.WSGIRequestHandler):
+    " Request handler without logging of every request to stderr "
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PreforkServer:
+    " Pre-fork WSGI server, services are prepared in parent process and then workers are forked "
+
+    ##
+    # seconds between checks of stop request in worker
+    POLL_INTERVAL = 0.5
+
+    ##
+    # @param application WSGI application
+    # @param host host name to bind
+    # @param port port to bind
+    # @param workers number of worker processes, None for number of processors
+    # @param services list of services interfaces names prepared before fork (see RpcHandler.warmUp)
+    def __init__(self, application, host = "", port = 8080, workers = None, services = ()):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.workers = workers
+        if self.workers == None:
+            self.workers = PreforkServer.__cpuCount()
+        self.services = services
+
+        self.__children = set()
+        self.__stopping = False
+        self.__server = None
+
+    ##
+    # prepare services, fork workers and wait until server is stopped (SIGTERM or SIGINT)
+    def run(self):
+        # pools of executors are started in workers, pool threads don't survive fork
+        core.RpcHandler.warmUp(self.services, False)
+        self.__server = simple_server.make_server(
+            self.host, self.port, self.application, handler_class = _QuietRequestHandler)
+        logging.info("PGR server listening on %s:%s with %s workers", self.host, self.port, self.workers)
+
+        for i in range(self.workers):
+            self.__spawn()
+
+        signal.signal(signal.SIGTERM, self.__stop)
+        signal.signal(signal.SIGINT, self.__stop)
+
+        while len(self.__children) > 0:
+            try:
+                pid, status = os.wait()
+            except OSError, inst:
+                if inst.errno == errno.EINTR:
+                    continue
+                break
+            self.__children.discard(pid)
+            if not self.__stopping:
+                logging.warning("PGR worker %s exited with status %s, starting new one", pid, status)
+                self.__spawn()
+
+        self.__server.server_close()
+        core.RpcHandler.shutdown()
+
+    def __spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # worker finishes current request, then releases services (onShutdown hooks)
+            self.__stopping = False
+            signal.signal(signal.SIGTERM, self.__stopWorker)
+            signal.signal(signal.SIGINT, self.__stopWorker)
+            try:
+                try:
+                    core.RpcHandler.startExecutors()
+                    self.__server.timeout = PreforkServer.POLL_INTERVAL
+                    while not self.__stopping:
+                        self.__server.handle_request()
+                    core.RpcHandler.shutdown()
+                except Exception, inst:
+                    logging.exception(inst)
+            finally:
+                os._exit(0)
+        self.__children.add(pid)
+
+    def __stopWorker(self, signum, frame):
+        self.__stopping = True
+
+    def __stop(self, signum, frame):
+        self.__stopping = True
+        for pid in list(self.__children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    @staticmethod
+    def __cpuCount():
+        try:
+            return os.sysconf("SC_NPROCESSORS_ONLN")
+        except (AttributeError, ValueError):
+            return 1
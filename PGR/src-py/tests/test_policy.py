@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of requests with elided type names, decoded by the serialization policy
+# shipped in static directory. Run from src-py directory:
+#
+#     python -m unittest tests.test_policy
+
+import os
+import unittest
+
+from pgr import core
+
+try:
+    from google.appengine.api import memcache
+except ImportError:
+    memcache = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+STRONG_NAME = "B9EC6BC12B67D9571EF3DE4F4A01DCCD"
+SERVICE = "pl.simpatico.pgrexample.client.services.ExampleService"
+SEPARATOR = u"￿"
+
+core.RpcHandler.POLICY_DIR = STATIC_DIR
+
+##
+# @param strings string table
+# @param tokens tokens after string table
+# @return request body of protocol version 7 with elided type names
+def elidedRequest(strings, tokens):
+    parts = ["7", str(core._RpcRequest.FLAG_ELIDE_TYPE_NAMES), str(len(strings))]
+    parts += strings + [str(t) for t in tokens]
+    return (SEPARATOR.join(parts) + SEPARATOR).encode("utf-8")
+
+
+class PolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = core._RpcSerializationPolicy.forStrongName(STRONG_NAME)
+
+    def testServiceInterface(self):
+        self.assertEqual(SERVICE, self.policy.className("_"))
+        self.assertFalse("_" in self.policy.typeSignatures)
+
+    def testTypes(self):
+        vo = "pl.simpatico.pgrexample.client.vo.ExampleVo2"
+        self.assertEqual(vo + "/1675329647", self.policy.typeSignatures[vo + "/1675329647"])
+        self.assertEqual(vo, self.policy.className(vo + "/1675329647"))
+        self.assertEqual("I", self.policy.className("I"))
+
+
+class ElidedRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        if memcache == None:
+            self.skipTest("example services require GAE")
+        core.RpcHandler.registerService(SERVICE)
+
+    def testPrimitiveParameters(self):
+        body = elidedRequest(["http://localhost/", STRONG_NAME, "_", "sumInts", "I"],
+                             [1, 2, 3, 4, 2, 5, 5, 10, 32])
+        req = core._RpcRequestReader().readRequest(body)
+        self.assertEqual(SERVICE, req.serviceIntfName)
+        self.assertEqual(["I", "I"], req.parameterTypes)
+        self.assertEqual(42, req.evaluate())
+
+    def testObjectParameter(self):
+        vo2 = "pl.simpatico.pgrexample.client.vo.ExampleVo2/1675329647"
+        vo3 = "pl.simpatico.pgrexample.client.vo.ExampleVo3/58486052"
+        body = elidedRequest(["http://localhost/", STRONG_NAME, "_", "subObject", vo2, vo3, "inner", "outer"],
+                             [1, 2, 3, 4, 1, 5, 5, 6, 7, 7, 9, 8])
+        req = core._RpcRequestReader().readRequest(body)
+        self.assertEqual(["pl.simpatico.pgrexample.client.vo.ExampleVo2"], req.parameterTypes)
+        src = req.parameterValues[0]
+        self.assertEqual("inner", src.objField.strField)
+        self.assertEqual("outer", src.strField)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of request reader on malformed requests. Run from src-py directory:
+#
+#     python -m unittest tests.test_reader
+
+import array
+import unittest
+
+from pgr import core
+from pgr import sig
+
+SERVICE = "tests.test_reader.EchoService"
+ARRAY_SERVICE = "tests.test_reader.ArrayService"
+SEPARATOR = u"￿"
+
+
+class EchoService:
+    __serialization__ = {
+        "echo": core.Types.STRING
+    }
+
+    def echo(self, s):
+        return s
+
+
+class ArrayService:
+    __serialization__ = {
+        "sumInts": core.Types.INT,
+        "sumDoubles": core.Types.DOUBLE,
+        "sumIntsNumpy": core.Types.INT,
+        "sumDoublesNumpy": core.Types.DOUBLE
+    }
+    __arrays__ = {
+        "sumInts": core.Arrays.ARRAY,
+        "sumDoubles": core.Arrays.ARRAY,
+        "sumIntsNumpy": core.Arrays.NUMPY,
+        "sumDoublesNumpy": core.Arrays.NUMPY
+    }
+
+    def sumInts(self, values):
+        return sum(values)
+
+    sumDoubles = sumIntsNumpy = sumDoublesNumpy = sumInts
+
+
+##
+# @param strings string table
+# @param tokens tokens after string table
+# @param version protocol version
+# @return request body
+def request(strings, tokens, version = 7):
+    parts = [str(version), "0", str(len(strings))] + strings + [str(t) for t in tokens]
+    return (SEPARATOR.join(parts) + SEPARATOR).encode("utf-8")
+
+##
+# @param value string table index of echo parameter value
+# @return request body of echo call
+def echoRequest(value):
+    return request(["http://localhost/", "STRONG", SERVICE, "echo", "java.lang.String", "abc"],
+                   [1, 2, 3, 4, 1, 5, value])
+
+
+##
+# @param method method of ArrayService
+# @param name array type name
+# @param values tokens of array elements
+# @return request body of call with one array parameter
+def arrayRequest(method, name, values):
+    return request(["http://localhost/", "STRONG", ARRAY_SERVICE, method, name, name + "/1"],
+                   [1, 2, 3, 4, 1, 5, 6, len(values)] + values)
+
+
+class ReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        core.RpcHandler.registerService(SERVICE)
+
+    def read(self, body):
+        return core._RpcRequestReader().readRequest(body)
+
+    def assertInvalid(self, body):
+        self.assertRaises(core._RpcException, self.read, body)
+
+    def testString(self):
+        self.assertEqual(["abc"], self.read(echoRequest(6)).parameterValues)
+        self.assertEqual([None], self.read(echoRequest(0)).parameterValues)
+
+    def testStringIndexOutOfTable(self):
+        self.assertInvalid(echoRequest(7))
+        self.assertInvalid(echoRequest(100))
+
+    def testNegativeStringIndex(self):
+        self.assertInvalid(echoRequest(-1))
+        self.assertInvalid(echoRequest(-2))
+
+    def testNotNumericToken(self):
+        self.assertInvalid((SEPARATOR.join(["7", "0", "2", "a", "b"]) + SEPARATOR).encode("utf-8"))
+
+    def testTruncatedRequest(self):
+        body = request(["http://localhost/", "STRONG", SERVICE, "echo", "java.lang.String"], [1, 2, 3, 4, 1, 5])
+        self.assertInvalid(body)
+
+
+class BulkArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        core.RpcHandler.registerService(ARRAY_SERVICE)
+        self.signatures = sig.__signatures__
+        sig.__signatures__ = dict(self.signatures)
+        sig.__signatures__.update({"[I": "1", "[D": "1"})
+
+    def tearDown(self):
+        sig.__signatures__ = self.signatures
+
+    def read(self, method, name, values):
+        return core._RpcRequestReader().readRequest(arrayRequest(method, name, values)).parameterValues[0]
+
+    def testIntArray(self):
+        res = self.read("sumInts", "[I", [1, -2, 2147483647])
+        self.assertTrue(isinstance(res, array.array))
+        self.assertEqual("i", res.typecode)
+        self.assertEqual([1, -2, 2147483647], res.tolist())
+
+    def testDoubleArray(self):
+        res = self.read("sumDoubles", "[D", [1.5, -2, "1e300"])
+        self.assertEqual("d", res.typecode)
+        self.assertEqual([1.5, -2.0, 1e300], res.tolist())
+
+    def testEmptyArray(self):
+        self.assertEqual([], self.read("sumInts", "[I", []).tolist())
+
+    def testIntOverflow(self):
+        self.assertRaisesRegexp(core._RpcException, "malformed", self.read, "sumInts", "[I", [1, 2147483648])
+
+    def testNotNumericElement(self):
+        self.assertRaisesRegexp(core._RpcException, "malformed", self.read, "sumInts", "[I", [1, "x"])
+
+    @unittest.skipIf(core.numpy is None, "numpy is not installed")
+    def testNumpyIntArray(self):
+        res = self.read("sumIntsNumpy", "[I", [1, -2, 2147483647])
+        self.assertTrue(isinstance(res, core.numpy.ndarray))
+        self.assertEqual("int32", res.dtype.name)
+        self.assertEqual([1, -2, 2147483647], res.tolist())
+
+    @unittest.skipIf(core.numpy is None, "numpy is not installed")
+    def testNumpyDoubleArray(self):
+        res = self.read("sumDoublesNumpy", "[D", [1.5, -2, "1e300"])
+        self.assertEqual("float64", res.dtype.name)
+        self.assertEqual([1.5, -2.0, 1e300], res.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
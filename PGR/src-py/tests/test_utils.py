@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of loading classes by names from requests. Run from src-py directory:
+#
+#     python -m unittest tests.test_utils
+
+import os
+import unittest
+
+from pgr import core
+
+SERVICE = "tests.test_utils.LoadedService"
+
+
+class LoadedService:
+    __serialization__ = {
+        "ping": core.Types.INT
+    }
+
+    def ping(self):
+        return 1
+
+
+class ClassForNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.packages = core.RpcHandler.ALLOWED_PACKAGES
+        core.RpcHandler.registerService(SERVICE)
+
+    def tearDown(self):
+        core.RpcHandler.ALLOWED_PACKAGES = self.packages
+
+    def testRegisteredService(self):
+        self.assertTrue(core._RpcUtils.class_for_name(SERVICE) is LoadedService)
+
+    def testNotAllowedByDefault(self):
+        self.assertRaises(core._RpcException, core._RpcUtils.class_for_name, "os.system")
+        self.assertFalse("os.system" in core._RpcUtils.__class_cache__)
+
+    def testAllowedPackage(self):
+        core.RpcHandler.ALLOWED_PACKAGES = ["tests"]
+        self.assertTrue(core._RpcUtils.class_for_name("tests.test_utils.ClassForNameTest") is ClassForNameTest)
+        self.assertRaises(core._RpcException, core._RpcUtils.class_for_name, "testsuite.Test")
+
+    def testAllPackages(self):
+        core.RpcHandler.ALLOWED_PACKAGES = None
+        self.assertTrue(core._RpcUtils.class_for_name("os.getcwd") is os.getcwd)
+
+    def testFailedLoadIsRemembered(self):
+        core.RpcHandler.ALLOWED_PACKAGES = ["tests"]
+        name = "tests.missing_module.Missing"
+        self.assertRaises(core._RpcException, core._RpcUtils.class_for_name, name)
+        self.assertTrue(name in core._RpcUtils.__class_errors__)
+        self.assertRaises(core._RpcException, core._RpcUtils.class_for_name, name)
+
+
+if __name__ == "__main__":
+    unittest.main()